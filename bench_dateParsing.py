@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks and regression corpus for the date_parser module
+
+    python bench_dateParsing.py micro [--baseline OLD_DATE_PARSER_PY] [--repeat N]
+
+times DateParsing.parse_date on every query of test_dateParsing.py and, when a
+baseline copy of date_parser.py is given (eg. from `git show <rev>:date_parser.py`),
+prints the per query cost of both versions side by side
+
+    python bench_dateParsing.py corpus [--per-family N] [--engine ENGINE]
+                                       [--record GOLDEN_JSON | --check GOLDEN_JSON]
+
+parses a generated corpus of realistic queries covering every rule family against the
+fixed REFERENCE_DATE, reports queries/sec, p50 / p99 latency and peak memory per family,
+and records the results as golden outputs or diffs them against recorded ones
+
+    python bench_dateParsing.py batch [--per-family N] [--duplication N] [--engine ENGINE]
+
+compares the throughput of DateParsing.parse_dates to a loop of parse_date calls on a
+large generated corpus, with distinct queries and with the repetitions of a query log
+
+    python bench_dateParsing.py startup [--runs N] [--engine ENGINE]
+
+times a cold start in fresh interpreters: importing date_parser, building a DateParsing
+and getting the first result of a query the rules resolve, and reports whether the
+fallback engine (natty and its JVM) got imported on the way
+"""
+from datetime import date, datetime
+from timeit import default_timer
+import argparse
+import importlib.util
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_PATH = os.path.join(HERE, 'golden_dateParsing.json')
+REFERENCE_DATE = date(2018, 3, 14)
+
+SUBJECTS = ["sales", "show me sales", "revenue", "what was the profit margin", "orders", "show me the churn",
+            "top 10 products by units sold", "sales in postal code 300"]
+MONTHS = ["january", "february", "march", "april", "may", "june", "july", "august", "september", "october",
+          "november", "december"]
+NUMBER_WORDS = ["one", "two", "three", "four", "five", "six", "seven", "eight", "nine"]
+ORDINALS = {1: "1st", 2: "2nd", 3: "3rd", 21: "21st", 22: "22nd", 23: "23rd", 31: "31st"}
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+
+def load_module(path, name):
+    """
+    Load a date_parser module from a file path
+    :param path:
+    :param name: module name to register it under
+    :return module:
+    """
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_queries():
+    """
+    Collect the queries used by test_dateParsing.py
+    :return list of queries:
+    """
+    with open(os.path.join(HERE, 'test_dateParsing.py')) as f:
+        source = f.read()
+    queries = []
+    for query in re.findall(r'parse_date\("([^"]*)"\)', source):
+        if query not in queries:
+            queries.append(query)
+    return queries
+
+
+def ordinal(day):
+    return ORDINALS.get(day, '%dth' % day)
+
+
+def generate_corpus(per_family=200, seed=0):
+    """
+    Generate a deterministic corpus of realistic queries
+    :param per_family: number of queries per rule family
+    :param seed: random seed
+    :return list of (rule family, query) pairs:
+    """
+    import date_parser
+    rnd = random.Random(seed)
+    phrases = sorted(date_parser.DateParsing(engine='python').time_phrases_and_ops)
+    n_periods = ["%s %s %ss" % (direction, n, unit) for direction in ("last", "past", "previous")
+                 for n in ("two", "three", "four", "6") for unit in ("week", "quarter")]
+
+    def year():
+        return rnd.randint(1995, 2025)
+
+    def day_month():
+        month = rnd.randint(1, 12)
+        return rnd.randint(1, 28), month, MONTHS[month - 1]
+
+    templates = {
+        'phrases': [
+            lambda: "%s %s" % (rnd.choice(SUBJECTS), rnd.choice(phrases)),
+            lambda: "%s for the %s" % (rnd.choice(SUBJECTS), rnd.choice(phrases)),
+            lambda: "%s by region %s" % (rnd.choice(phrases), rnd.choice(SUBJECTS)),
+            lambda: "%s for the %s" % (rnd.choice(SUBJECTS), rnd.choice(n_periods)),
+        ],
+        'year': [
+            lambda: "%s in %d" % (rnd.choice(SUBJECTS), year()),
+            lambda: "%s for the year %d" % (rnd.choice(SUBJECTS), year()),
+            lambda: "%s between %d and %d" % (rnd.choice(SUBJECTS), year(), year()),
+            lambda: "%s from %d to %d" % (rnd.choice(SUBJECTS), year(), year()),
+            lambda: "%s %s" % (rnd.choice(SUBJECTS), rnd.choice(["this year", "for the current year"])),
+        ],
+        'month': [
+            lambda: "%s for %s" % (rnd.choice(SUBJECTS), rnd.choice(MONTHS)),
+            lambda: "%s in the month of %s" % (rnd.choice(SUBJECTS), rnd.choice(MONTHS)),
+            lambda: "%s for this %s" % (rnd.choice(SUBJECTS), rnd.choice(MONTHS)),
+            lambda: "%s during %s %d" % (rnd.choice(SUBJECTS), rnd.choice(MONTHS), year()),
+        ],
+        'n_month': [
+            lambda: "%s for %s %s months" % (rnd.choice(SUBJECTS), rnd.choice(["last", "past", "previous"]),
+                                             rnd.choice(NUMBER_WORDS + [str(n) for n in range(1, 10)])),
+        ],
+        'before_after': [
+            lambda: "%s before %d/%d/%d" % ((rnd.choice(SUBJECTS),) + day_month()[:2] + (year(),)),
+            lambda: "%s after %d/%d" % ((rnd.choice(SUBJECTS),) + day_month()[:2]),
+            lambda: "%s upto %d/%d/%d" % (rnd.choice(SUBJECTS), year(), rnd.randint(1, 12), rnd.randint(1, 28)),
+            lambda: "%s up to %s %d" % ((rnd.choice(SUBJECTS),) + day_month()[2:] + (rnd.randint(1, 28),)),
+            lambda: "%s after %d %s" % ((rnd.choice(SUBJECTS),) + day_month()[::2]),
+            lambda: "%s before %s %s %d" % (rnd.choice(SUBJECTS), rnd.choice(MONTHS), ordinal(rnd.randint(1, 28)),
+                                            year()),
+        ],
+        'fallback': [
+            lambda: "%s from %s %s to %s %s" % (rnd.choice(SUBJECTS), ordinal(rnd.randint(1, 28)), rnd.choice(MONTHS),
+                                                ordinal(rnd.randint(1, 28)), rnd.choice(MONTHS)),
+            lambda: "%s in the %s %s days" % (rnd.choice(SUBJECTS), rnd.choice(["past", "last"]),
+                                              rnd.choice(NUMBER_WORDS)),
+            lambda: "show me %s %s years %s" % (rnd.choice(["last", "past"]), rnd.choice(NUMBER_WORDS[1:5]),
+                                                rnd.choice(["data", "sales"])),
+            lambda: "%s %s %s" % (rnd.choice(SUBJECTS), rnd.choice(["last", "next", "on"]), rnd.choice(WEEKDAYS)),
+            lambda: "%s on the %s of %s" % (rnd.choice(SUBJECTS), ordinal(rnd.randint(1, 28)), rnd.choice(MONTHS)),
+            lambda: "%s %s %d information" % (rnd.choice(MONTHS), rnd.choice(SUBJECTS), year()),
+            lambda: "%s from %d weeks ago" % (rnd.choice(SUBJECTS), rnd.randint(1, 9)),
+        ],
+    }
+    corpus = []
+    for family in sorted(templates):
+        for _ in range(per_family):
+            corpus.append((family, rnd.choice(templates[family])()))
+    return corpus
+
+
+def parse_or_error(dt_parse, query, reference_date):
+    """
+    Parse a query, turning an exception into a comparable value
+    :return date range, None or 'error: <exception name>':
+    """
+    try:
+        return dt_parse.parse_date(query, reference_date)
+    except Exception as e:
+        return 'error: %s' % type(e).__name__
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def time_query(dt_parse, query, repeat):
+    """
+    Time parse_date on a query
+    :param dt_parse: DateParsing instance
+    :param query:
+    :param repeat: number of calls
+    :return microseconds per call or the name of the raised exception:
+    """
+    try:
+        dt_parse.parse_date(query)
+        start = default_timer()
+        for _ in range(repeat):
+            dt_parse.parse_date(query)
+        return (default_timer() - start) / repeat * 1e6
+    except Exception as e:
+        return type(e).__name__
+
+
+def format_cell(value):
+    if isinstance(value, float):
+        return '%10.1f' % value
+    return '%10s' % value
+
+
+def micro(args):
+    versions = [('current', load_module(os.path.join(HERE, 'date_parser.py'), 'date_parser'))]
+    if args.baseline:
+        versions.insert(0, ('baseline', load_module(args.baseline, 'date_parser_baseline')))
+
+    queries = test_queries()
+    width = max(len(query) for query in queries)
+    print('%-*s %s' % (width, 'query (us/call)', ' '.join('%10s' % name for name, _ in versions)))
+    totals = [0.0] * len(versions)
+    for query in queries:
+        cells = []
+        for i, (_, module) in enumerate(versions):
+            value = time_query(module.DateParsing(), query, args.repeat)
+            if isinstance(value, float):
+                totals[i] += value
+            cells.append(format_cell(value))
+        print('%-*s %s' % (width, query, ' '.join(cells)))
+    print('%-*s %s' % (width, 'total', ' '.join(format_cell(total) for total in totals)))
+
+
+def corpus(args):
+    import date_parser
+    queries = generate_corpus(args.per_family, args.seed)
+    dt_parse = date_parser.DateParsing(engine=args.engine)
+
+    by_family = {}
+    for family, query in queries:
+        by_family.setdefault(family, []).append(query)
+    print('%-14s %8s %12s %10s %10s %12s' % ('family', 'queries', 'queries/s', 'p50 us', 'p99 us', 'peak KiB'))
+    results = {}
+    for family in sorted(by_family):
+        latencies = []
+        start = default_timer()
+        for query in by_family[family]:
+            call_start = default_timer()
+            results[query] = parse_or_error(dt_parse, query, REFERENCE_DATE)
+            latencies.append(default_timer() - call_start)
+        elapsed = default_timer() - start
+
+        tracemalloc.start()
+        for query in by_family[family]:
+            parse_or_error(dt_parse, query, REFERENCE_DATE)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('%-14s %8d %12.0f %10.1f %10.1f %12.1f' % (family, len(latencies), len(latencies) / elapsed,
+                                                         percentile(latencies, 0.5) * 1e6,
+                                                         percentile(latencies, 0.99) * 1e6, peak / 1024.0))
+
+    golden = {'reference_date': REFERENCE_DATE.isoformat(), 'engine': args.engine,
+              'queries': [[family, query, results[query]] for family, query in queries]}
+    if args.record:
+        with open(args.record, 'w') as f:
+            f.write('{"engine": %s, "reference_date": %s, "queries": [\n' % (json.dumps(golden['engine']),
+                                                                           json.dumps(golden['reference_date'])))
+            f.write(',\n'.join(json.dumps(entry) for entry in golden['queries']))
+            f.write('\n]}\n')
+        print('recorded %d golden outputs to %s' % (len(queries), args.record))
+    if args.check:
+        mismatches = check_golden(args.check, dt_parse)
+        for family, query, expected, actual in mismatches:
+            print('MISMATCH [%s] %r: expected %r, got %r' % (family, query, expected, actual))
+        print('%d mismatches against %s' % (len(mismatches), args.check))
+        return 1 if mismatches else 0
+    return 0
+
+
+def check_golden(path, dt_parse=None):
+    """
+    Diff the current parse results against recorded golden outputs
+    :param path: golden JSON file
+    :param dt_parse: DateParsing to check, built with the recorded engine when missing
+    :return list of (family, query, expected, actual) mismatches:
+    """
+    import date_parser
+    with open(path) as f:
+        golden = json.load(f)
+    reference_date = datetime.strptime(golden['reference_date'], '%Y-%m-%d').date()
+    if dt_parse is None:
+        dt_parse = date_parser.DateParsing(engine=golden['engine'])
+    mismatches = []
+    for family, query, expected in golden['queries']:
+        actual = parse_or_error(dt_parse, query, reference_date)
+        if actual != expected:
+            mismatches.append((family, query, expected, actual))
+    return mismatches
+
+
+def batch(args):
+    import date_parser
+    distinct = list(dict.fromkeys(query for _, query in generate_corpus(args.per_family, args.seed)))
+    # a query log repeats its queries: draw the batch from the distinct ones with replacement
+    rnd = random.Random(args.seed)
+    repeated = [rnd.choice(distinct) for _ in range(len(distinct) * args.duplication)]
+
+    print('%-10s %8s %8s %14s %14s %8s' % ('corpus', 'queries', 'distinct', 'parse_date q/s', 'parse_dates q/s',
+                                           'speedup'))
+    for name, queries in (('distinct', distinct), ('repeated', repeated)):
+        dt_parse = date_parser.DateParsing(engine=args.engine)
+        start = default_timer()
+        for query in queries:
+            parse_or_error(dt_parse, query, REFERENCE_DATE)
+        single = len(queries) / (default_timer() - start)
+
+        dt_parse = date_parser.DateParsing(engine=args.engine)
+        start = default_timer()
+        dt_parse.parse_dates(queries, REFERENCE_DATE, errors='return')
+        batched = len(queries) / (default_timer() - start)
+        print('%-10s %8d %8d %14.0f %14.0f %7.2fx' % (name, len(queries), len(set(queries)), single, batched,
+                                                     batched / single))
+    return 0
+
+
+STARTUP_SCRIPT = """
+from timeit import default_timer
+start = default_timer()
+import date_parser
+imported = default_timer()
+dt_parse = date_parser.DateParsing(engine=%r)
+constructed = default_timer()
+dt_parse.parse_date("show me sales in 2013")
+first_result = default_timer()
+import json, sys
+print(json.dumps([imported - start, constructed - imported, first_result - constructed, first_result - start,
+                  'natty' in sys.modules]))
+"""
+
+
+def startup(args):
+    columns = ('import', 'construct', 'first parse', 'total')
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT % args.engine], cwd=HERE)
+        runs.append(json.loads(output.decode()))
+    print('%-14s %12s %12s' % ('ms', 'median', 'max'))
+    for i, name in enumerate(columns):
+        values = [run[i] * 1e3 for run in runs]
+        print('%-14s %12.2f %12.2f' % (name, statistics.median(values), max(values)))
+    print('fallback engine imported: %s' % any(run[-1] for run in runs))
+    return 0
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = arg_parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    micro_parser = subparsers.add_parser('micro', help='per query cost on the test_dateParsing.py queries')
+    micro_parser.add_argument('--baseline', help='path of another date_parser.py to compare against')
+    micro_parser.add_argument('--repeat', type=int, default=1000, help='calls per query (default: 1000)')
+    micro_parser.set_defaults(func=micro)
+
+    corpus_parser = subparsers.add_parser('corpus', help='per family throughput and golden outputs on a generated corpus')
+    corpus_parser.add_argument('--per-family', type=int, default=200, help='queries per rule family (default: 200)')
+    corpus_parser.add_argument('--seed', type=int, default=0, help='corpus random seed (default: 0)')
+    corpus_parser.add_argument('--engine', default='natty', help='fallback engine (default: natty)')
+    corpus_parser.add_argument('--record', help='write the results as golden outputs to this file')
+    corpus_parser.add_argument('--check', help='diff the results against the golden outputs of this file')
+    corpus_parser.set_defaults(func=corpus)
+
+    batch_parser = subparsers.add_parser('batch', help='parse_dates against a parse_date loop on a generated corpus')
+    batch_parser.add_argument('--per-family', type=int, default=2000, help='queries per rule family (default: 2000)')
+    batch_parser.add_argument('--duplication', type=int, default=5,
+                              help='repeated corpus size as a multiple of the distinct queries (default: 5)')
+    batch_parser.add_argument('--seed', type=int, default=0, help='corpus random seed (default: 0)')
+    batch_parser.add_argument('--engine', default='natty', help='fallback engine (default: natty)')
+    batch_parser.set_defaults(func=batch)
+
+    startup_parser = subparsers.add_parser('startup', help='import to first result time in fresh interpreters')
+    startup_parser.add_argument('--runs', type=int, default=20, help='interpreters to start (default: 20)')
+    startup_parser.add_argument('--engine', default='natty', help='fallback engine (default: natty)')
+    startup_parser.set_defaults(func=startup)
+
+    args = arg_parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the natty fallback: a fresh natty.DateParser per call against the pooled
+NattyEngine, called once per text and with the whole batch at once
+
+    python bench_natty.py [--texts N] [--threads N]
+"""
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer
+import argparse
+
+from date_parser import NattyEngine
+
+TEXTS = ["15th november to 6th december", "the past two days", "last two years", "last friday",
+         "january 3rd 2013", "4 july", "december 8", "the 14th of january", "june 2017", "next tuesday"]
+
+
+def report(name, latencies, elapsed):
+    """
+    Print latency percentiles and throughput of a run
+    :param name:
+    :param latencies: seconds per text
+    :param elapsed: wall clock seconds for all texts
+    """
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print('%-22s p50 %9.1f us   p99 %9.1f us   %10.0f texts/s'
+          % (name, p50 * 1e6, p99 * 1e6, len(latencies) / elapsed))
+
+
+def timed(func, texts):
+    """
+    Call func once per text
+    :return list of per call latencies and total elapsed seconds:
+    """
+    latencies = []
+    start = default_timer()
+    for text in texts:
+        call_start = default_timer()
+        func(text)
+        latencies.append(default_timer() - call_start)
+    return latencies, default_timer() - start
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--texts', type=int, default=2000, help='number of texts to parse (default: 2000)')
+    arg_parser.add_argument('--threads', type=int, default=4, help='threads sharing the pooled engine (default: 4)')
+    args = arg_parser.parse_args(argv)
+    texts = [TEXTS[i % len(TEXTS)] for i in range(args.texts)]
+
+    start = default_timer()
+    engine = NattyEngine()
+    engine.parse(texts[0], None)
+    print('natty import and first parse: %.1f ms' % ((default_timer() - start) * 1e3))
+
+    from natty import DateParser
+    report('per call DateParser', *timed(lambda text: DateParser(text).result(), texts))
+    report('pooled parse', *timed(lambda text: engine.parse(text, None), texts))
+
+    start = default_timer()
+    engine.parse_many(texts)
+    elapsed = default_timer() - start
+    report('pooled parse_many', [elapsed / len(texts)] * len(texts), elapsed)
+
+    with ThreadPoolExecutor(args.threads) as pool:
+        start = default_timer()
+        list(pool.map(lambda text: engine.parse(text, None), texts))
+        elapsed = default_timer() - start
+    print('%-22s %49.0f texts/s' % ('pooled, %d threads' % args.threads, len(texts) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,22 +2,1153 @@
 
 """
 Module to parse input string and interpret/extract dates from it
+
+Run as a script to parse a query log, one query (or JSON record with --field) per line:
+
+    python date_parser.py queries.txt --workers 8 --reference-date 2018-03-14 > dates.jsonl
 """
-from natty import DateParser
 from time import strptime
 from datetime import datetime, timedelta, date
+from contextlib import contextmanager
+from collections import OrderedDict, deque, namedtuple
+from itertools import islice
+from array import array
+from functools import lru_cache
+from bisect import bisect_left
+from timeit import default_timer
+from types import MappingProxyType
+# asyncio, concurrent.futures and argparse are only needed by AsyncDateParsing, parse_stream and
+# the command line: they are imported where used to keep the import of this module cheap
+import json
+import os
+import sys
+import threading
 import re
 
 
+# Registry of the precompiled rules shared by all DateParsing methods. The rules run on lower
+# cased queries: without re.IGNORECASE the regex engine can skip ahead to their literals
+ONLY_YEAR_REGEX1 = re.compile(r'(before|after|in|during|for the year|for|from)\s([0-9]{4})\b(?!after)')
+ONLY_YEAR_REGEX2 = re.compile(
+    r'(from|between|before)\s([0-9]{4})(\s| to | and |-| and after | after )([0-9]{4})(?=\D|$)')
+# dd[-/ .]mm[-/ .]yyyy
+DATEFORMAT1_REGEX = re.compile(r'[0-3]?[0-9]{1}[-/ .]{1}[0-1]?[0-9]{1}((-|/| |.){1}\d{4})?(\s|$)')
+# yyyy[-/ .]mm[-/ .]dd
+DATEFORMAT2_REGEX = re.compile(r'[0-9]{4}[-/ .]{1}[0-1]?[0-9]{1}[-/ .]{1}[0-3]?[0-9]{1}')
+# mm[-/ .]dd[-/ .]yyyy, used instead of DATEFORMAT1_REGEX by the month first rule packs
+DATEFORMAT3_REGEX = re.compile(r'[0-1]?[0-9]{1}[-/ .]{1}[0-3]?[0-9]{1}((-|/| |.){1}\d{4})?(\s|$)')
+# the month rules, filled in with the words introducing a month and the month names of a rule pack
+MONTH_PATTERN = r'(%(prefixes)s){1}\s(%(months)s)(\s|$)'
+MONTH_YEAR_PATTERN = r'(%(prefixes)s){1}\s(%(months)s){1}\s([0-9]{4})'
+ENGLISH_MONTHS = 'January|February|March|April|May|June|July|August|September|October|November|December'
+# the N of "last N months / weeks / quarters"
+N_PATTERN = r'(?:[0-9]+|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve)'
+N_MONTH_REGEX = re.compile(r'(last|past|previous)\s(%s)\s(month|months)' % N_PATTERN)
+# "last N weeks / quarters", matched by the phrase matcher alongside the time phrases
+N_PERIOD_PATTERN = r'(?P<n_period>(?:last|past|previous)\s(?P<n>%s)\s(?P<unit>week|quarter)s)' % N_PATTERN
+# fiscal quarters and years: "q3", "q3 2017", "q1 of fy2018", "fiscal year 2017", "fy 2017"
+QUARTER_PATTERN = (r'(?P<quarter>(?:fiscal\s+)?q(?P<quarter_q>[1-4])(?:\s+(?:of\s+)?(?:fy\s*|fiscal\s+year\s+)?'
+                   r'(?P<quarter_y>[0-9]{4}))?|(?:fy\s*|fiscal\s+year\s+)(?P<quarter_fy>[0-9]{4}))\b')
+QUARTER_REGEX = re.compile(r'\b' + QUARTER_PATTERN)
+
+# Pre-classifier telling which rule families could apply to a query: every rule family needs
+# at least one of its trigger words (the month names of the rule packs for 'month'), looked
+# up as substrings, or a match of its trigger regex to be present
+TRIGGER_WORDS = {
+    'year': ('this year', 'current year'),
+    'before': ('before', 'upto', 'up to'),
+    'after': ('after',),
+    'n_month': ('month',),
+    'quarter': ('fiscal',),
+}
+YEAR_TRIGGER_REGEX = re.compile(r'[0-9]{4}')
+QUARTER_TRIGGER_REGEX = re.compile(r'\bq[1-4]\b|\bfy')
+TRIGGER_FAMILIES = {
+    'year': ('year',),
+    'before': ('before', 'month'),
+    'after': ('after', 'month'),
+    'month': ('month',),
+    'n_month': ('n_month',),
+    'quarter': ('quarter',),
+}
+
+
+def classify(query):
+    """
+    Function returning the rule families of the English rules that could resolve the query,
+    see RuleSet.classify
+    :param query:
+    :return set of rule family names:
+    """
+    return rule_set('en').classify(query.lower())
+
+
+class _FallbackRequired(Exception):
+    """
+    Raised while resolving a batch in rules-only mode when a query needs the fallback engine
+    """
+
+
+class NattyEngine:
+    """
+    Long lived fallback engine delegating to natty. natty (and the JVM behind it) is only
+    imported on the first parse, after which the same Java parser is reused for every call.
+    Calls are serialized on natty's lock, so one instance can be shared by a pool of threads
+    """
+    # natty ignores the reference date, its results are memoized under the system date
+    resolves_against_system_date = True
+
+    def __init__(self, rules=None):
+        """
+        :param rules: ignored, natty only reads English
+        """
+        self._natty = None
+
+    def _load(self):
+        """
+        Import natty (starting the JVM) on first use
+        :return natty module:
+        """
+        if self._natty is None:
+            import natty
+            self._natty = natty
+        return self._natty
+
+    def prewarm(self):
+        """
+        Import natty and start its JVM now rather than on the first parse
+        """
+        self._load()
+
+    def parse(self, text, reference_date):
+        """
+        Parse a piece of text with natty. natty always resolves against the system date
+        :param text:
+        :param reference_date: ignored
+        :return list of datetimes of the first date group or None:
+        """
+        return self.parse_many([text], reference_date)[0]
+
+    def parse_many(self, texts, reference_date=None):
+        """
+        Parse many pieces of text taking natty's lock (and attaching the thread to the JVM)
+        once for the whole batch
+        :param texts:
+        :param reference_date: ignored
+        :return list of results of parse, in the order of texts:
+        """
+        natty = self._load()
+        if not natty.jpype.isThreadAttachedToJVM():
+            natty.jpype.attachThreadToJVM()
+        results = []
+        with natty.lock:
+            for text in texts:
+                date_groups = natty.NattyParser.parseDateIntoGroups(text)
+                if date_groups is not None and len(date_groups):
+                    results.append([natty.parser.parse(d.toString()) for d in list(date_groups)[0].dates])
+                else:
+                    results.append(None)
+        return results
+
+
+MONTH_NUMBERS = {
+    'january': 1, 'february': 2, 'march': 3, 'april': 4, 'may': 5, 'june': 6, 'july': 7,
+    'august': 8, 'september': 9, 'october': 10, 'november': 11, 'december': 12,
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'jun': 6, 'jul': 7, 'aug': 8, 'sep': 9,
+    'sept': 9, 'oct': 10, 'nov': 11, 'dec': 12
+}
+WEEKDAY_NUMBERS = {
+    'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3, 'friday': 4, 'saturday': 5,
+    'sunday': 6
+}
+NUMBER_WORDS = {
+    'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6,
+    'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12
+}
+
+
+def _point_pattern(months, weekdays):
+    """
+    Function building the PythonEngine grammar for a set of month and weekday names
+    :param months: dict of month names to numbers
+    :param weekdays: dict of weekday names to numbers
+    :return pattern:
+    """
+    return (
+        r'\b(?:'
+        r'(?P<iso>(?P<iso_y>[0-9]{4})-(?P<iso_m>[0-9]{1,2})-(?P<iso_d>[0-9]{1,2}))'
+        r'|(?P<mdy>(?P<mdy_m>[0-9]{1,2})/(?P<mdy_d>[0-9]{1,2})/(?P<mdy_y>[0-9]{4}))'
+        r'|(?P<dm>(?:the\s+)?(?P<dm_d>[0-3]?[0-9])%(o)s?\s+(?:of\s+)?(?P<dm_m>%(m)s)\.?(?:,?\s+(?P<dm_y>[0-9]{4}))?)'
+        r'|(?P<md>(?P<md_m>%(m)s)\.?\s+(?:the\s+)?(?P<md_d>[0-3]?[0-9])%(o)s?(?:,?\s+(?P<md_y>[0-9]{4}))?)'
+        r'|(?P<my>(?P<my_m>%(m)s)\.?,?\s+(?P<my_y>[0-9]{4}))'
+        r'|(?P<span>(?P<span_dir>last|past|previous|next|coming)\s+(?P<span_n>%(n)s)\s+(?P<span_unit>%(u)s)s?)'
+        r'|(?P<ago>(?P<ago_n>%(n)s)\s+(?P<ago_unit>%(u)s)s?\s+ago)'
+        r'|(?P<weekday>(?:(?P<weekday_dir>last|next|this|on)\s+)?(?P<weekday_name>%(w)s))'
+        r'|(?P<day>today|tomorrow|yesterday)'
+        r'|(?P<current>now|this\s+(?:week|month|year))'
+        r'|(?P<ordinal>the\s+(?P<ordinal_d>[0-3]?[0-9])%(o)s)'
+        r'|(?P<month>(?P<month_m>%(m)s))'
+        r')\b' % {'m': r'(?:%s)' % '|'.join(sorted(months, key=len, reverse=True)),
+                  'n': r'(?:[0-9]+|%s)' % '|'.join(sorted(NUMBER_WORDS, key=len, reverse=True)),
+                  'u': r'(?:day|week|month|year)', 'o': r'(?:st|nd|rd|th)',
+                  'w': '|'.join(sorted(weekdays, key=len, reverse=True))})
+
+
+class PythonEngine:
+    """
+    Pure python fallback engine covering the expressions natty is used for: explicit and
+    ordinal dates ("15th November", "december 8", "june 2017", "31/01/2018"), ranges between
+    two of them ("15th November to 6th December"), relative spans ("past two days",
+    "last two years", "next 3 weeks", "2 months ago") and weekday names ("last friday")
+    """
+    RANGE_CONNECTOR_REGEX = re.compile(r'\s*(?:to|till|until|through|and|-)\s*', re.IGNORECASE)
+
+    def __init__(self, rules=None):
+        """
+        :param rules: RuleSet adding its month / weekday names to the English ones and deciding
+                      the order of nn/nn/yyyy dates, rule_set('en') (day first) by default
+        """
+        if rules is None:
+            rules = rule_set('en')
+        self.POINT_REGEX = rules.point_regex
+        self.months, self.weekdays, self.day_first = rules.point_months, rules.point_weekdays, rules.day_first
+
+    def parse(self, text, reference_date):
+        """
+        Parse the first date expression (or range of two expressions) in a piece of text
+        :param text:
+        :param reference_date: date the relative expressions are resolved against
+        :return list of dates or None:
+        """
+        for m in self.POINT_REGEX.finditer(text):
+            try:
+                dates = self._resolve(m, reference_date)
+            except ValueError:
+                continue
+            if len(dates) == 1:
+                connector = self.RANGE_CONNECTOR_REGEX.match(text, m.end())
+                if connector:
+                    m_end = self.POINT_REGEX.match(text, connector.end())
+                    if m_end:
+                        try:
+                            dates.extend(self._resolve(m_end, reference_date)[-1:])
+                        except ValueError:
+                            pass
+            return dates
+        return None
+
+    def parse_many(self, texts, reference_date):
+        """
+        :param texts:
+        :param reference_date:
+        :return list of results of parse, in the order of texts:
+        """
+        return [self.parse(text, reference_date) for text in texts]
+
+    def _resolve(self, m, today):
+        """
+        Turn a match of POINT_REGEX into dates
+        :param m: match object
+        :param today: reference date
+        :return list of dates:
+        """
+        kind = m.lastgroup
+        g = m.group
+        if kind == 'iso':
+            return [date(int(g('iso_y')), int(g('iso_m')), int(g('iso_d')))]
+        if kind == 'mdy':
+            if self.day_first:
+                return [date(int(g('mdy_y')), int(g('mdy_d')), int(g('mdy_m')))]
+            return [date(int(g('mdy_y')), int(g('mdy_m')), int(g('mdy_d')))]
+        if kind in ('dm', 'md', 'my'):
+            year = g(kind + '_y')
+            day = g(kind + '_d') if kind != 'my' else 1
+            return [date(int(year) if year else today.year, self.months[g(kind + '_m').lower()], int(day))]
+        if kind == 'span':
+            n = self._number_value(g('span_n'))
+            if g('span_dir').lower() in ('next', 'coming'):
+                return [today, self._shift(today, g('span_unit').lower(), n)]
+            return [self._shift(today, g('span_unit').lower(), -n), today]
+        if kind == 'ago':
+            return [self._shift(today, g('ago_unit').lower(), -self._number_value(g('ago_n')))]
+        if kind == 'weekday':
+            return [self._weekday(today, self.weekdays[g('weekday_name').lower()], (g('weekday_dir') or '').lower())]
+        if kind == 'day':
+            return [today + timedelta(days={'today': 0, 'tomorrow': 1, 'yesterday': -1}[g('day').lower()])]
+        if kind == 'current':
+            return [today]
+        if kind == 'ordinal':
+            return [today.replace(day=int(g('ordinal_d')))]
+        return [date(today.year, self.months[g('month_m').lower()], 1)]
+
+    @staticmethod
+    def _number_value(number):
+        """
+        :param number: digits or number word
+        :return int value:
+        """
+        number = number.lower()
+        if number in NUMBER_WORDS:
+            return NUMBER_WORDS[number]
+        return int(number)
+
+    @staticmethod
+    def _shift(day, unit, n):
+        """
+        Move a date by n days / weeks / months / years, clamping the day of month
+        :return shifted date:
+        """
+        if unit == 'day':
+            return day + timedelta(days=n)
+        if unit == 'week':
+            return day + timedelta(weeks=n)
+        months = n if unit == 'month' else 12 * n
+        year, month = divmod(day.year * 12 + day.month - 1 + months, 12)
+        month += 1
+        days_in_month = ((date(year + month // 12, month % 12 + 1, 1)) - timedelta(days=1)).day
+        return date(year, month, min(day.day, days_in_month))
+
+    @staticmethod
+    def _weekday(today, weekday, direction):
+        """
+        Resolve a weekday name. "next" is the first one after today, "this" the one of the
+        current (Monday based) week, and "last" / a bare name the latest one before today
+        (or today itself for a bare name)
+        :return date:
+        """
+        if direction == 'next':
+            return today + timedelta(days=(weekday - today.weekday() - 1) % 7 + 1)
+        if direction == 'this':
+            return today + timedelta(days=weekday - today.weekday())
+        if direction == 'last':
+            return today - timedelta(days=(today.weekday() - weekday - 1) % 7 + 1)
+        return today - timedelta(days=(today.weekday() - weekday) % 7)
+
+
+# Rule families of the pipeline as alternatives of a single pattern, used by DateParsing.extract_all
+# together with the time phrases and the PythonEngine grammar. On a tie the first alternative wins.
+# The month names and the words introducing them are filled in by RuleSet
+EXTRACT_RULES_PATTERN = (
+    r'(?P<year_span>(?:from|between|before)\s(?P<year_span_a>[0-9]{4})(?:\s| to | and |-| and after | after )'
+    r'(?P<year_span_b>[0-9]{4}))(?=\D|$)'
+    r'|(?P<year>(?P<year_kw>before|after|in|during|for the year|for|from)\s(?P<year_y>[0-9]{4}))\b(?!after)'
+    r'|(?P<this_year>this year|current year)'
+    r'|(?P<this_month>this month)'
+    r'|(?P<slash_before>(?P<slash_kw>before|up to|upto|after)\s(?P<slash_a>[0-9]{1,4})/(?P<slash_b>[0-9]{1,2})'
+    r'(?:/(?P<slash_c>[0-9]{1,4}))?)\b'
+    r'|(?P<keyword>(?:before|up to|upto|after)\s+)'
+    r'|(?P<month_year>(?:%(prefixes)s)\s(?P<month_year_m>%(months)s)\s(?P<month_year_y>[0-9]{4}))'
+    r'|(?P<month_name>(?:%(prefixes)s)\s(?P<month_name_m>%(months)s))\b'
+    r'|(?P<n_month>(?:last|past|previous)\s(?P<n_month_n>' + N_PATTERN + r')\smonths?)\b'
+    r'|' + QUARTER_PATTERN
+)
+
+ENGINES = {
+    'natty': NattyEngine,
+    'python': PythonEngine
+}
+
+
+class RulePack:
+    """
+    Locale and format conventions of the rules: whether nn/nn[/yyyy] dates are day or month
+    first, the month and weekday names, the words introducing a month ("in march") and the
+    month the fiscal year starts in. The other keywords of the rules stay English.
+    Immutable and compared by value, so equal packs share their compiled RuleSet
+    """
+    def __init__(self, name, months, weekdays, month_prefixes, day_first=True, fiscal_year_start=1):
+        """
+        :param name:
+        :param months: dict of lower case month names to month numbers
+        :param weekdays: dict of lower case weekday names to weekday numbers, Monday is 0
+        :param month_prefixes: words introducing a month, or a month and a year
+        :param day_first: read nn/nn[/yyyy] as day/month, else as month/day
+        :param fiscal_year_start: first month of the fiscal year. A fiscal year starting after
+                                  January is named after the calendar year it ends in
+        """
+        attributes = {'name': name, 'months': MappingProxyType(dict(months)),
+                      'weekdays': MappingProxyType(dict(weekdays)), 'month_prefixes': tuple(month_prefixes),
+                      'day_first': day_first, 'fiscal_year_start': fiscal_year_start}
+        self.__dict__.update(attributes)
+        self.__dict__['_key'] = (name, tuple(sorted(months.items())), tuple(sorted(weekdays.items())),
+                                 tuple(month_prefixes), day_first, fiscal_year_start)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RulePack is immutable, use replace(%s=...)" % name)
+
+    def __eq__(self, other):
+        return isinstance(other, RulePack) and self._key == other._key
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __reduce__(self):
+        # sent to the worker processes of parse_stream, the read-only name maps don't pickle
+        return RulePack, (self.name, dict(self.months), dict(self.weekdays), self.month_prefixes, self.day_first,
+                          self.fiscal_year_start)
+
+    def replace(self, **changes):
+        """
+        :param changes: attributes to change, eg. name='acme', fiscal_year_start=10
+        :return new RulePack:
+        """
+        attributes = dict((name, value) for name, value in vars(self).items() if name != '_key')
+        attributes.update(changes)
+        return RulePack(**attributes)
+
+    def __repr__(self):
+        return 'RulePack(%r)' % self.name
+
+
+RULE_PACKS = {
+    'en': RulePack('en', dict((month.lower(), i + 1) for i, month in enumerate(ENGLISH_MONTHS.split('|'))),
+                   WEEKDAY_NUMBERS, ('for', 'in', 'during', 'for the month of', 'for this', 'in the month of')),
+    'de': RulePack('de', {'januar': 1, 'jänner': 1, 'februar': 2, 'märz': 3, 'maerz': 3, 'april': 4, 'mai': 5,
+                          'juni': 6, 'juli': 7, 'august': 8, 'september': 9, 'oktober': 10, 'november': 11,
+                          'dezember': 12},
+                   {'montag': 0, 'dienstag': 1, 'mittwoch': 2, 'donnerstag': 3, 'freitag': 4, 'samstag': 5,
+                    'sonnabend': 5, 'sonntag': 6},
+                   ('im', 'in', 'für', 'fuer', 'während', 'im monat', 'für den monat')),
+    'fr': RulePack('fr', {'janvier': 1, 'février': 2, 'fevrier': 2, 'mars': 3, 'avril': 4, 'mai': 5, 'juin': 6,
+                          'juillet': 7, 'août': 8, 'aout': 8, 'septembre': 9, 'octobre': 10, 'novembre': 11,
+                          'décembre': 12, 'decembre': 12},
+                   {'lundi': 0, 'mardi': 1, 'mercredi': 2, 'jeudi': 3, 'vendredi': 4, 'samedi': 5, 'dimanche': 6},
+                   ('en', 'pour', 'pendant', 'durant', 'au mois de', 'pour le mois de')),
+    'es': RulePack('es', {'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4, 'mayo': 5, 'junio': 6, 'julio': 7,
+                          'agosto': 8, 'septiembre': 9, 'setiembre': 9, 'octubre': 10, 'noviembre': 11,
+                          'diciembre': 12},
+                   {'lunes': 0, 'martes': 1, 'miércoles': 2, 'miercoles': 2, 'jueves': 3, 'viernes': 4,
+                    'sábado': 5, 'sabado': 5, 'domingo': 6},
+                   ('en', 'para', 'durante', 'en el mes de', 'para el mes de')),
+}
+RULE_PACKS['en_US'] = RULE_PACKS['en'].replace(name='en_US', day_first=False)
+
+
+def _alternation(words):
+    """
+    :param words:
+    :return regex alternation of the words, longest first:
+    """
+    return '|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+
+
+class RuleSet:
+    """
+    Rule packs compiled together (see rule_set). Every rule gets a single regex whose
+    alternatives cover the names of all the packs, so adding a locale doesn't add passes over
+    the query. The first pack decides the date order and the fiscal year
+    """
+    def __init__(self, packs):
+        """
+        :param packs: tuple of RulePack
+        """
+        self.packs = packs
+        self.day_first = packs[0].day_first
+        self.fiscal_year_start = packs[0].fiscal_year_start
+        self.months = {}
+        self.weekdays = {}
+        prefixes = []
+        for pack in packs:
+            self.months.update(pack.months)
+            self.weekdays.update(pack.weekdays)
+            prefixes.extend(prefix for prefix in pack.month_prefixes if prefix not in prefixes)
+        names = {'prefixes': _alternation(prefixes), 'months': _alternation(self.months)}
+        # (trigger word, families) pairs of the pre-classifier
+        self.triggers = tuple((word, TRIGGER_FAMILIES[trigger]) for trigger, words in
+                              sorted(dict(TRIGGER_WORDS, month=tuple(self.months)).items()) for word in words)
+        self.month_regex = re.compile(MONTH_PATTERN % names)
+        self.month_year_regex = re.compile(MONTH_YEAR_PATTERN % names)
+        self.numeric_regex = DATEFORMAT1_REGEX if self.day_first else DATEFORMAT3_REGEX
+        self.extract_pattern = EXTRACT_RULES_PATTERN % names
+        # the PythonEngine grammar keeps the English names next to the ones of the packs
+        self.point_months = dict(MONTH_NUMBERS, **self.months)
+        self.point_weekdays = dict(WEEKDAY_NUMBERS, **self.weekdays)
+        self._point_regex = None
+        # matchers compiled from TIME_PHRASES and these rules, shared by the DateParsing
+        # instances that didn't register phrases
+        self.shared_matchers = {}
+
+    @property
+    def point_regex(self):
+        """
+        PythonEngine grammar of the packs, compiled on first use
+        """
+        if self._point_regex is None:
+            self._point_regex = re.compile(_point_pattern(self.point_months, self.point_weekdays), re.IGNORECASE)
+        return self._point_regex
+
+    def classify(self, query):
+        """
+        Method returning the rule families that could resolve the query, from the substring
+        lookups of their trigger words, which beat a single regex scan for all of them
+        :param query: lower cased query
+        :return set of rule family names:
+        """
+        families = set()
+        for word, word_families in self.triggers:
+            if word in query:
+                families.update(word_families)
+        if 'year' not in families and YEAR_TRIGGER_REGEX.search(query):
+            families.add('year')
+        if 'quarter' not in families and ('q' in query or 'fy' in query) and QUARTER_TRIGGER_REGEX.search(query):
+            families.add('quarter')
+        return families
+
+    def fiscal_year_of(self, day):
+        """
+        :param day: date
+        :return number of the fiscal year the date falls in:
+        """
+        if self.fiscal_year_start > 1 and day.month >= self.fiscal_year_start:
+            return day.year + 1
+        return day.year
+
+    def fiscal_year(self, year):
+        """
+        :param year: fiscal year number
+        :return first and last day of the fiscal year:
+        """
+        start = date(year if self.fiscal_year_start == 1 else year - 1, self.fiscal_year_start, 1)
+        return start, PythonEngine._shift(start, 'year', 1) - timedelta(days=1)
+
+    def fiscal_quarter(self, year, quarter):
+        """
+        :param year: fiscal year number
+        :param quarter: 1 to 4
+        :return first and last day of the quarter of the fiscal year:
+        """
+        start = PythonEngine._shift(self.fiscal_year(year)[0], 'month', 3 * (quarter - 1))
+        return start, PythonEngine._shift(start, 'month', 3) - timedelta(days=1)
+
+
+@lru_cache(maxsize=32)
+def _compile_rules(packs):
+    return RuleSet(packs)
+
+
+def rule_set(rules):
+    """
+    Function compiling rule packs together, once per combination of packs, compared by value.
+    The most recently used combinations are kept compiled
+    :param rules: name of RULE_PACKS, RulePack, or sequence of them
+    :return RuleSet:
+    """
+    if isinstance(rules, (str, RulePack)):
+        rules = (rules,)
+    packs = []
+    for pack in rules:
+        if isinstance(pack, str):
+            if pack not in RULE_PACKS:
+                raise ValueError("Unknown rule pack %r, expected one of %s" % (pack, ', '.join(sorted(RULE_PACKS))))
+            pack = RULE_PACKS[pack]
+        packs.append(pack)
+    return _compile_rules(tuple(packs))
+
+
+def normalize_query(query):
+    """
+    Function to normalize a query into its result cache key. Only the case and the surrounding
+    whitespace go: the rules read punctuation ("before 30/10, please") and runs of spaces
+    :param query:
+    :return normalized query:
+    """
+    return query.lower().strip()
+
+
+def as_date(value):
+    """
+    Function to read a reference date from a date, a datetime or a clock (callable returning
+    either)
+    :param value:
+    :return date:
+    """
+    if callable(value):
+        value = value()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+EPOCH = date(1970, 1, 1)
+
+
+class _OpenRange(tuple):
+    """
+    (EPOCH, end) range whose start is open, found by a rule other than 'before' (eg. the month
+    rule on "before ...")
+    """
+    __slots__ = ()
+
+
+def format_dates(dates, rule=None):
+    """
+    Function formatting dates as the YYYY-MM-DD strings returned by parse_date. The open start
+    of the ranges of the 'before' rule and of _OpenRange is written 1970-1-1, as it always was
+    :param dates: tuple of dates or None
+    :param rule: name of the rule that found the dates
+    :return list of strings or None:
+    """
+    if dates is None:
+        return None
+    # isoformat is ~6x cheaper than strftime and gives the same string from the year 1000 on
+    strings = [d.isoformat() if d.year >= 1000 else d.strftime('%Y-%m-%d') for d in dates]
+    if rule == 'before' or isinstance(dates, _OpenRange):
+        strings[0] = '1970-1-1'
+    return strings
+
+
+class DateRange(namedtuple('DateRange', ['start', 'end', 'rule'])):
+    """
+    Immutable, compact parse result. start and end are proleptic Gregorian ordinals
+    (date.toordinal()), end is None for a single date and rule names the stage that matched
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_dates(cls, dates, rule=None):
+        """
+        :param dates: tuple of one or two dates
+        :param rule:
+        :return DateRange:
+        """
+        return cls(dates[0].toordinal(), dates[1].toordinal() if len(dates) > 1 else None, rule)
+
+    @property
+    def start_date(self):
+        return date.fromordinal(self.start)
+
+    @property
+    def end_date(self):
+        return None if self.end is None else date.fromordinal(self.end)
+
+    def isoformat(self):
+        """
+        :return list of one or two ISO formatted dates:
+        """
+        if self.end is None:
+            return [self.start_date.isoformat()]
+        return [self.start_date.isoformat(), self.end_date.isoformat()]
+
+
+DateMention = namedtuple('DateMention', ['start', 'end', 'text', 'rule', 'dates'])
+DateMention.__doc__ = """
+Date expression found by DateParsing.extract_all: start and end are character offsets in the
+text (text[start:end] == mention.text), rule names the rule that matched and dates is the date
+range, formatted like the result of parse_date
+"""
+
+
+def pack_ranges(ranges):
+    """
+    Function packing DateRange results into two contiguous integer arrays of start and end
+    ordinals. Single dates get end = start and missing results 0 in both arrays
+    :param ranges: iterable of DateRange or None
+    :return (starts, ends) arrays:
+    """
+    starts = array('l')
+    ends = array('l')
+    for date_range in ranges:
+        if date_range is None:
+            starts.append(0)
+            ends.append(0)
+        else:
+            starts.append(date_range.start)
+            ends.append(date_range.start if date_range.end is None else date_range.end)
+    return starts, ends
+
+
+class PeriodTable:
+    """
+    Bounds of the named calendar periods relative to a reference date, computed once per
+    reference date (see period_table). Monday based weeks end on the Monday before the
+    reference week, to match the existing week ranges
+    """
+    def __init__(self, today):
+        """
+        :param today: reference date
+        """
+        self.today = today
+        self.monday = today - timedelta(days=today.weekday())
+        last_of_previous_month = today.replace(day=1) - timedelta(days=1)
+        self.last_month = (last_of_previous_month.replace(day=1), last_of_previous_month)
+        self.this_month = (date(self.monday.year, self.monday.month, 1),)
+        self.yesterday = (today - timedelta(days=1),)
+        self.prior_quarter = self.last_quarters(1)
+        self.previous_year = self.last_years(1)
+        self.fortnight = self.last_weeks(2)
+
+    def last_weeks(self, n):
+        """
+        :param n:
+        :return n weeks before the reference week:
+        """
+        return self.monday - timedelta(days=7 * (n + 1)), self.monday - timedelta(days=7)
+
+    def last_months(self, n):
+        """
+        :param n:
+        :return the n calendar months before the current one:
+        """
+        start_year, start_month = divmod(self.today.year * 12 + self.today.month - 1 - n, 12)
+        return date(start_year, start_month + 1, 1), self.today - timedelta(days=self.today.day)
+
+    def last_quarters(self, n):
+        """
+        :param n:
+        :return n calendar quarters before the current one:
+        """
+        quarter_start = self.today.year * 12 + (self.today.month - 1) // 3 * 3
+        start_year, start_month = divmod(quarter_start - 3 * n, 12)
+        end_year, end_month = divmod(quarter_start, 12)
+        return date(start_year, start_month + 1, 1), date(end_year, end_month + 1, 1) - timedelta(days=1)
+
+    def last_years(self, n):
+        """
+        :param n:
+        :return n calendar years before the current one:
+        """
+        return date(self.today.year - n, 1, 1), date(self.today.year - 1, 12, 31)
+
+    def last(self, unit, n):
+        """
+        :param unit: 'week', 'month', 'quarter' or 'year'
+        :param n:
+        :return bounds of the last n units:
+        """
+        return getattr(self, 'last_%ss' % unit)(n)
+
+
+@lru_cache(maxsize=16)
+def period_table(today):
+    """
+    Function returning the PeriodTable of a reference date, shared by all DateParsing instances
+    :param today: reference date
+    :return PeriodTable:
+    """
+    return PeriodTable(today)
+
+
+class ResultCache:
+    """
+    Thread safe bounded LRU cache of parse results keyed on (normalized query, reference date).
+    Entries resolved against an earlier day are dropped as soon as the system date rolls over
+    """
+    _missing = object()
+
+    def __init__(self, maxsize=4096, clock=date.today):
+        """
+        :param maxsize: maximum number of entries, the least recently used one is evicted first
+        :param clock: clock whose day change expires the entries
+        """
+        self.maxsize = maxsize
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._day = as_date(clock)
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, query, reference_date, default=None):
+        """
+        :param query: normalized query
+        :param reference_date:
+        :param default: returned on a miss
+        :return cached result or default:
+        """
+        key = (query, reference_date)
+        with self._lock:
+            self._roll_over()
+            value = self._entries.get(key, self._missing)
+            if value is self._missing:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, query, reference_date, value):
+        """
+        :param query: normalized query
+        :param reference_date:
+        :param value: parse result
+        """
+        key = (query, reference_date)
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _roll_over(self):
+        """
+        Drop the entries resolved against a day before today once the clock's date changed
+        """
+        today = as_date(self.clock)
+        if today != self._day:
+            self._day = today
+            for key in [key for key in self._entries if key[1] < today]:
+                del self._entries[key]
+                self.expirations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        """
+        :return dict of the cache counters and size:
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'expirations': self.expirations, 'size': len(self._entries), 'maxsize': self.maxsize}
+
+
+class FallbackMemo:
+    """
+    Persistent memo of the fallback engine results keyed on (namespace, text, reference date),
+    the namespace telling apart the engines and rules sharing the file. It is kept in a
+    SQLite file that the processes of a host can share: the database runs in WAL mode, so
+    readers never block, and writers wait up to timeout seconds for each other. Every thread
+    and every (forked) process opens its own connection, on first use
+    """
+    # texts looked up per SELECT, below SQLite's limit on the number of parameters
+    BATCH = 500
+
+    def __init__(self, path, timeout=30.0):
+        """
+        :param path: SQLite file, created when missing
+        :param timeout: seconds a writer waits for the database lock
+        """
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self.hits = self.misses = 0
+
+    def _connection(self):
+        """
+        :return the connection of the current thread and process:
+        """
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            import sqlite3
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS fallback (namespace TEXT NOT NULL, reference_date TEXT '
+                               'NOT NULL, text TEXT NOT NULL, dates TEXT, PRIMARY KEY (namespace, reference_date, text)) '
+                               'WITHOUT ROWID')
+            local.connection, local.pid = connection, os.getpid()
+        return local.connection
+
+    def get_many(self, texts, reference_date, namespace=''):
+        """
+        :param texts:
+        :param reference_date:
+        :param namespace: engine and rules the results were produced with
+        :return dict of the memoized texts to their list of dates (or None when the engine found nothing):
+        """
+        connection = self._connection()
+        found = {}
+        texts = list(texts)
+        for i in range(0, len(texts), self.BATCH):
+            batch = texts[i:i + self.BATCH]
+            rows = connection.execute('SELECT text, dates FROM fallback WHERE namespace = ? AND reference_date = ? '
+                                      'AND text IN (%s)' % ','.join('?' * len(batch)),
+                                      [namespace, reference_date.isoformat()] + batch)
+            for text, dates in rows:
+                found[text] = None if dates is None else [date.fromisoformat(d) for d in dates.split(',')]
+        self.hits += len(found)
+        self.misses += len(texts) - len(found)
+        return found
+
+    def put_many(self, results, reference_date, namespace=''):
+        """
+        Store engine results in a single transaction
+        :param results: dict of texts to lists of dates / datetimes or None
+        :param reference_date:
+        :param namespace: engine and rules the results were produced with
+        """
+        rows = [(namespace, reference_date.isoformat(), text,
+                 None if dates is None else ','.join(as_date(d).isoformat() for d in dates))
+                for text, dates in results.items()]
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany('INSERT OR REPLACE INTO fallback VALUES (?, ?, ?, ?)', rows)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def invalidate(self, reference_date):
+        """
+        Drop the results resolved against a reference date
+        :param reference_date:
+        :return number of entries dropped:
+        """
+        return self._connection().execute('DELETE FROM fallback WHERE reference_date = ?',
+                                          (reference_date.isoformat(),)).rowcount
+
+    def prune(self, before):
+        """
+        Drop the results resolved against a reference date earlier than before
+        :param before: date
+        :return number of entries dropped:
+        """
+        return self._connection().execute('DELETE FROM fallback WHERE reference_date < ?',
+                                          (before.isoformat(),)).rowcount
+
+    def info(self):
+        """
+        :return dict of the lookup counters of this instance and the number of stored entries:
+        """
+        size = self._connection().execute('SELECT COUNT(*) FROM fallback').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'size': size}
+
+    def close(self):
+        """
+        Close the connection of the current thread
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            connection.close()
+        self._local.connection = self._local.pid = None
+
+
+class StageProfiler:
+    """
+    Thread safe collector of per stage call counts, hit counts and latencies of
+    DateParsing.parse_date. Optionally calls back with the stage that answered each query
+    """
+    # upper bounds (in seconds) of the latency histogram buckets
+    BUCKETS = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0)
+
+    def __init__(self, callback=None):
+        """
+        :param callback: called with {'query', 'stage', 'seconds'} once per parsed query,
+                         stage being None when nothing matched
+        """
+        self.callback = callback
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+            self._queries = 0
+            self._unresolved = 0
+
+    def run(self, name, stage, query):
+        """
+        Run and time a stage
+        :param name: stage name
+        :param stage: stage method
+        :param query:
+        :return result of the stage:
+        """
+        start = default_timer()
+        dates = stage(query)
+        seconds = default_timer() - start
+        with self._lock:
+            counters = self._stages.get(name)
+            if counters is None:
+                counters = self._stages[name] = {'calls': 0, 'hits': 0, 'seconds': 0.0,
+                                                 'histogram': [0] * (len(self.BUCKETS) + 1)}
+            counters['calls'] += 1
+            counters['hits'] += 1 if dates else 0
+            counters['seconds'] += seconds
+            counters['histogram'][bisect_left(self.BUCKETS, seconds)] += 1
+        return dates
+
+    def answered(self, query, stage, seconds):
+        """
+        Record the stage that answered a query
+        :param query:
+        :param stage: stage name or None
+        :param seconds: time spent on the whole query
+        """
+        with self._lock:
+            self._queries += 1
+            if stage is None:
+                self._unresolved += 1
+        if self.callback is not None:
+            self.callback({'query': query, 'stage': stage, 'seconds': seconds})
+
+    def stats(self):
+        """
+        :return plain dict of the collected counters:
+        """
+        labels = ['<=%g' % bound for bound in self.BUCKETS] + ['>%g' % self.BUCKETS[-1]]
+        with self._lock:
+            return {
+                'queries': self._queries,
+                'unresolved': self._unresolved,
+                'stages': dict((name, {'calls': counters['calls'], 'hits': counters['hits'],
+                                       'seconds': counters['seconds'],
+                                       'histogram': dict(zip(labels, counters['histogram']))})
+                               for name, counters in self._stages.items())
+            }
+
+
+# Commonly used time phrases and the DateParsing method giving their dates. Shared, read only,
+# by every instance until register_phrase gives an instance its own copy
+TIME_PHRASES = MappingProxyType({
+    'previous day': '_yesterday_dates',
+    'yesterday': '_yesterday_dates',
+    'previous week': '_week_dates',
+    'last week': '_week_dates',
+    'fortnightly': '_fortnight_dates',
+    'fortnight': '_fortnight_dates',
+    'last month': '_last_month_dates',
+    'previous month': '_last_month_dates',
+    'previous quarter': '_prior_quarter_dates',
+    'quarter prior to the this': '_prior_quarter_dates',
+    'last quarter': '_prior_quarter_dates',
+    'last year': '_previous_year_dates',
+    'previous year': '_previous_year_dates',
+    'current month': '_this_mth_dates',
+    'ongoing month': '_this_mth_dates'
+})
+
+
 class DateParsing:
     """
     Class to extract date / date ranges from a string
     """
-    def __init__(self):
+    def __init__(self, engine='natty', cache_size=None, clock=date.today, profiler=None, memo=None, rules=None):
         """
         Constructor to load a dictionary of common time phrases
+        :param engine: fallback engine for what the rules can't resolve, 'natty', 'python'
+                       or an object with a parse(text, reference_date) method
+        :param cache_size: enables a result cache of that many entries, keyed on normalize_query
+        :param clock: reference date of the queries, either a fixed date or a callable
+                      returning one. It is read once per query / batch
+        :param profiler: StageProfiler collecting per stage timings, True for a new one
+        :param memo: FallbackMemo, or the path (str or os.PathLike) of its SQLite file, keeping
+                     the fallback engine results across processes and restarts
+        :param rules: name of RULE_PACKS, RulePack or list of them compiled together, 'en' by
+                      default. They are also given to a fallback engine picked by name
         """
+        self.clock = clock
+        self.rules = rule_set(rules or 'en')
+        if isinstance(engine, str):
+            if engine not in ENGINES:
+                raise ValueError("Unknown engine %r, expected one of %s" % (engine, ', '.join(sorted(ENGINES))))
+            engine = ENGINES[engine](self.rules)
+        self.engine = engine
+        # grammar of the dates extract_all reads without the rules
+        self._grammar = PythonEngine(self.rules)
+        self.cache = ResultCache(cache_size, clock if callable(clock) else date.today) if cache_size else None
+        self.memo = FallbackMemo(memo) if isinstance(memo, (str, os.PathLike)) else memo
+        # the results of an engine depend on the rules it was given, eg. their date order
+        self._memo_namespace = '%s:%s:%s' % (type(engine).__name__, '+'.join(pack.name for pack in self.rules.packs),
+                                             'dmy' if self.rules.day_first else 'mdy')
+        self._local = threading.local()
+        self.profiler = StageProfiler() if profiler is True else profiler
         self.__load()
+        # (stage name, rule family the stage needs or None, method) in the order they are tried
+        self._stages = (
+            ('year', 'year', self._only_year_dates),
+            ('before', 'before', self._before_dates),
+            ('after', 'after', self._after_dates),
+            ('phrases', None, self._phrase_dates),
+            ('quarter', 'quarter', self._quarter_dates),
+            ('month', 'month', self._month_dates),
+            ('n_month', 'n_month', self._n_month_dates),
+            ('fallback', None, self._fallback_dates),
+        )
+
+    def _today(self):
+        """
+        Method to return the reference date of the query / batch being parsed. Falls back
+        to the clock when nothing is pinned
+        :return reference date:
+        """
+        reference_date = getattr(self._local, 'reference_date', None)
+        if reference_date is None:
+            return as_date(self.clock)
+        return reference_date
+
+    def _engine_today(self):
+        """
+        Method to return the date the fallback engine resolves against: the system date for an
+        engine with a true resolves_against_system_date attribute (natty), else the reference date
+        :return date:
+        """
+        if getattr(self.engine, 'resolves_against_system_date', False):
+            return date.today()
+        return self._today()
+
+    @contextmanager
+    def _reference(self, reference_date=None, rules_only=False):
+        """
+        Context manager pinning the reference date (and the per-reference memo of phrase
+        evaluations) for the current thread. Nested calls reuse the outer pin
+        :param reference_date: date to pin, defaults to the clock's date
+        :param rules_only: raise _FallbackRequired instead of calling the fallback engine
+        """
+        local = self._local
+        saved = (getattr(local, 'reference_date', None), getattr(local, 'memo', None),
+                 getattr(local, 'rules_only', False))
+        if saved[0] is None or reference_date is not None:
+            local.reference_date = as_date(reference_date or self.clock)
+            local.memo = {}
+        local.rules_only = rules_only
+        try:
+            yield local.reference_date
+        finally:
+            local.reference_date, local.memo, local.rules_only = saved
+
+    def _fallback_result(self, text):
+        """
+        Method to run the fallback engine on a piece of text
+        :param text:
+        :return list of dates / datetimes or None:
+        """
+        if getattr(self._local, 'rules_only', False):
+            raise _FallbackRequired(text)
+        prefetched = getattr(self._local, 'prefetched', None)
+        if prefetched and text in prefetched:
+            return prefetched[text]
+        if self.memo is not None:
+            return self._engine_parse_many([text], self._today())[0]
+        return self.engine.parse(text, self._today())
+
+    def _engine_parse_many(self, texts, reference_date):
+        """
+        Method to run the fallback engine on many texts, looking them up in the memo first and
+        storing what the engine found there. The memo entries of an engine with a true
+        resolves_against_system_date attribute are keyed on the system date
+        :param texts:
+        :param reference_date:
+        :return list of results in the order of texts:
+        """
+        if self.memo is None:
+            return self.engine.parse_many(texts, reference_date)
+        memo_date = date.today() if getattr(self.engine, 'resolves_against_system_date', False) else reference_date
+        results = self.memo.get_many(texts, memo_date, self._memo_namespace)
+        missing = [text for text in texts if text not in results]
+        if missing:
+            if hasattr(self.engine, 'parse_many'):
+                found = dict(zip(missing, self.engine.parse_many(missing, reference_date)))
+            else:
+                found = dict((text, self.engine.parse(text, reference_date)) for text in missing)
+            self.memo.put_many(found, memo_date, self._memo_namespace)
+            results.update(found)
+        return [results[text] for text in texts]
+
+    def _evaluate(self, func):
+        """
+        Method to evaluate an operation of the phrase table, memoized per reference date
+        :param func:
+        :return the evaluated date range:
+        """
+        memo = getattr(self._local, 'memo', None)
+        if memo is None:
+            return func()
+        if func not in memo:
+            memo[func] = func()
+        return memo[func]
 
     def date_monday(self):
         """
@@ -25,127 +1156,211 @@ class DateParsing:
         calculate a date range eg. last week = last Monday to previous Monday
         :return date of last monday:
         """
-        day_no = date.today().weekday()
+        today = self._today()
+        day_no = today.weekday()
         if day_no == 0:
-            return date.today()
+            return today
         else:
-            return date.today() - timedelta(days=day_no)
+            return today - timedelta(days=day_no)
 
     def __load(self):
         """
-        Private method(using name mangling) containing dictionary of commonly used time
-        phrases and the corresponding operations to obtain the dates
-        """
-        self.time_phrases_and_ops = {
-            'previous day': "self.day_evaluation()",
-            'yesterday': "self.day_evaluation()",
-            'previous week': "self.week_evaluation()",
-            'last week': "self.week_evaluation()",
-            'fortnightly': "self.fortnight_evaluation()",
-            'fortnight': "self.fortnight_evaluation()",
-            "last two weeks": "self.fortnight_evaluation()",
-            "past two weeks": "self.fortnight_evaluation()",
-            'last month': "self.last_month_evaluation()",
-            'previous month': "self.last_month_evaluation()",
-            'previous quarter': "self.prior_quarter_evaluation()",
-            'quarter prior to the this': "self.prior_quarter_evaluation()",
-            'last quarter': "self.prior_quarter_evaluation()",
-            'last year': "self.previous_year_evaluation()",
-            'previous year': "self.previous_year_evaluation()",
-            'current month': "self.this_mth_evaluation()",
-            'ongoing month': "self.this_mth_evaluation()",
-            "last three weeks": "self.three_week_evaluation()",
-            "past three weeks": "self.three_week_evaluation()",
-            "last four weeks" : "self.four_week_evaluation()",
-            "past four weeks" : "self.four_week_evaluation()"
-        }
+        Private method(using name mangling) pointing the instance to the shared table of
+        commonly used time phrases, TIME_PHRASES
+        """
+        self._phrases = TIME_PHRASES
+        self._matchers = {}
+
+    @property
+    def time_phrases_and_ops(self):
+        """
+        Read-only mapping of the time phrases and the corresponding operations to obtain the
+        dates, a snapshot of the phrase table. Phrases are added with register_phrase
+        """
+        return MappingProxyType(dict((phrase, getattr(self, func) if isinstance(func, str) else func)
+                                     for phrase, func in self._phrases.items()))
+
+    def _phrase_operation(self, phrase):
+        """
+        :param phrase: lower cased phrase of the phrase table
+        :return the operation giving the dates of the phrase:
+        """
+        func = self._phrases[phrase]
+        if isinstance(func, str):
+            return getattr(self, func)
+        return func
+
+    def _matcher(self, name):
+        """
+        Compile (once) the phrase index or the extract_all matcher of the phrase table and rule
+        set. The matchers of TIME_PHRASES are kept by the rule set, shared by all the instances
+        using both
+        :param name: 'phrase' or 'extract'
+        :return compiled regex:
+        """
+        matchers = self.rules.shared_matchers if self._phrases is TIME_PHRASES else self._matchers
+        if name not in matchers:
+            if name == 'phrase':
+                matchers[name] = re.compile(self._phrase_pattern())
+            else:
+                matchers[name] = re.compile(r'\b(?:%s|%s|(?P<point>%s))' % (
+                    self.rules.extract_pattern, self._phrase_pattern(), self._grammar.POINT_REGEX.pattern),
+                    re.IGNORECASE)
+        return matchers[name]
+
+    def prewarm(self, fallback=False):
+        """
+        Do the one time work of the first queries up front: compile the phrase matchers, load
+        the strptime machinery and compute the periods of today. Call it in a parent process
+        before forking workers so that they all share that state copy-on-write. natty runs a
+        JVM, which doesn't survive a fork, so only prewarm the fallback engine in the process
+        that will use it
+        :param fallback: also load the fallback engine
+        :return self:
+        """
+        self._matcher('phrase')
+        self._matcher('extract')
+        strptime('jan', '%b')
+        period_table(as_date(self.clock))
+        if fallback and hasattr(self.engine, 'prewarm'):
+            self.engine.prewarm()
+        return self
+
+    def register_phrase(self, phrase, func):
+        """
+        Method to add (or override) a time phrase at runtime. The phrase index is rebuilt
+        lazily on the next lookup
+        :param phrase: phrase to look for in the (lower cased) query
+        :param func: callable taking no arguments and returning the date range, as dates or
+                     as YYYY-MM-DD strings
+        """
+        if self._phrases is TIME_PHRASES:
+            self._phrases = dict(TIME_PHRASES)
+        self._phrases[phrase.lower()] = func
+        self._matchers = {}
+
+    def match_phrase(self, query):
+        """
+        Find the time phrase of the phrase table (or "last N weeks / quarters") contained
+        in the query in a single scan. The leftmost phrase wins, and among phrases starting at
+        the same position the longest one wins
+        :param query: lower cased query
+        :return matched phrase or None:
+        """
+        m = self._match_phrase(query)
+        if m:
+            return m.group()
+        return None
+
+    def _match_phrase(self, query):
+        """
+        :param query: lower cased query
+        :return match object of the phrase index or None:
+        """
+        return self._matcher('phrase').search(query)
+
+    def _phrase_pattern(self):
+        """
+        :return pattern matching the time phrases, longest first, and "last N weeks / quarters":
+        """
+        phrases = sorted(self._phrases, key=len, reverse=True)
+        return r'(?P<phrase>%s)|%s' % ('|'.join(re.escape(phrase) for phrase in phrases), N_PERIOD_PATTERN)
+
+    def _periods(self):
+        """
+        :return PeriodTable of the reference date:
+        """
+        return period_table(self._today())
 
     def this_mth_evaluation(self):
         """
         Method to obtain current month date range
         :return date value from 1st of ongoing month to current date:
         """
-        return [(date(self.date_monday().year, self.date_monday().month, 1)).strftime("%Y-%m-%d")]
+        return format_dates(self._this_mth_dates())
+
+    def _this_mth_dates(self):
+        return self._periods().this_month
 
     def day_evaluation(self):
         """
-        Method to obtain current date(= date on last Monday)
-        :return current date(= date on last Monday):
+        Method to obtain the date of yesterday
+        :return date of the day before the reference date:
         """
-        return self.date_monday()
+        return format_dates(self._yesterday_dates())
+
+    def _yesterday_dates(self):
+        return self._periods().yesterday
 
     def three_week_evaluation(self):
         """
         Method to obtain date range for past three weeks
         :return:
         """
-        today = self.date_monday()
-        start_date = today - timedelta(days=28)
-        end_date = start_date + timedelta(days=21)
-        return [start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")]
+        return format_dates(self._three_week_dates())
+
+    def _three_week_dates(self):
+        return self._periods().last_weeks(3)
 
     def four_week_evaluation(self):
         """
         Method to obtain date range for past four weeks
         :return:
         """
-        today = self.date_monday()
-        start_date = today - timedelta(days=35)
-        end_date = start_date + timedelta(days=28)
-        return [start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")]
+        return format_dates(self._four_week_dates())
+
+    def _four_week_dates(self):
+        return self._periods().last_weeks(4)
 
     def week_evaluation(self):
         """
         Method to obtain last week date range
         :return date range of previous week:
         """
-        today = self.date_monday()
-        start_date = today - timedelta(days=14)
-        end_date = start_date + timedelta(days=7)
-        return [start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")]
+        return format_dates(self._week_dates())
+
+    def _week_dates(self):
+        return self._periods().last_weeks(1)
 
     def fortnight_evaluation(self):
         """
         Method to obtain fortnight date range
         :return date range of last fortnight:
         """
-        today = self.date_monday()
-        start_date = today - timedelta(days=21)
-        end_date = start_date + timedelta(days=14)
-        return [start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")]
+        return format_dates(self._fortnight_dates())
+
+    def _fortnight_dates(self):
+        return self._periods().fortnight
 
     def last_month_evaluation(self):
         """
         Method to obtain last month date range
         :return last month date range:
         """
-        return [(date.today().replace(day=1) - timedelta(days=1)).replace(day=1).strftime('%Y-%m-%d'),
-                (date.today().replace(day=1) - timedelta(days=1)).strftime('%Y-%m-%d')]
+        return format_dates(self._last_month_dates())
+
+    def _last_month_dates(self):
+        return self._periods().last_month
 
     def prior_quarter_evaluation(self):
         """
         Method to obtain last quarter date range
         :return last quarter date range:
         """
-        today = date.today()
-        curr_quarter = (today.month - 1) / 3 + 1
-        if curr_quarter == 1:
-            start_date = date(today.year - 1, 10, 1)
-            end_date = date(today.year - 1, 12, 1)
-        else:
-            start_date = date(today.year, 3 * (curr_quarter - 1) + 1, 1)
-            end_date = date(today.year, 3 * (curr_quarter - 1) + 4, 1) + timedelta(days=-1)
-        return [start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")]
+        return format_dates(self._prior_quarter_dates())
+
+    def _prior_quarter_dates(self):
+        return self._periods().prior_quarter
 
     def previous_year_evaluation(self):
         """
         Method to obtain last year date range
         :return last year date range:
         """
-        today = date.today()
-        start_date = date(today.year - 1, 1, 1)
-        end_date = date(today.year - 1, 12, 31)
-        return [start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")]
+        return format_dates(self._previous_year_dates())
+
+    def _previous_year_dates(self):
+        return self._periods().previous_year
 
     def only_year_parse(self, query):
         """
@@ -153,13 +1368,13 @@ class DateParsing:
         :param query:
         :return year / year range:
         """
+        return format_dates(self._only_year_dates(query.lower()), 'year')
+
+    def _only_year_dates(self, query):
         if "this year" in query or "current year" in query:
-            return [date(date.today().year,1,1).strftime('%Y-%m-%d'), date(date.today().year,date.today().month,date.today().day).strftime('%Y-%m-%d')]
-        only_year_regex1 = re.compile(r'(before|after|in|during|for the year|for|from)\s([0-9]{4})\b(?!after)', re.IGNORECASE)
-        only_year_regex2 = re.compile(
-            r'(from|between|before)\s([0-9]{4})(\s| to | and |-| and after | after )([0-9]{4})(?=\D|$)', re.IGNORECASE)
-        m1 = only_year_regex1.search(query)
-        m2 = only_year_regex2.search(query)
+            return date(self._today().year, 1, 1), self._today()
+        m1 = ONLY_YEAR_REGEX1.search(query)
+        m2 = ONLY_YEAR_REGEX2.search(query)
         if m1:
             captured_values1 = m1.groups()
         if m2:
@@ -167,15 +1382,13 @@ class DateParsing:
 
         if m1:
             if captured_values1[0] == 'before':
-                return [date(1970,1,1).strftime('%Y-%m-%d'), date(int(captured_values1[1]), 1, 1).strftime('%Y-%m-%d')]
+                return EPOCH, date(int(captured_values1[1]), 1, 1)
             elif captured_values1[0] == 'after':
-                return [date(int(captured_values1[1]), 1, 1).strftime('%Y-%m-%d'), date.today().strftime('%Y-%m-%d')]
+                return date(int(captured_values1[1]), 1, 1), self._today()
         elif m2:
-            return [date(int(captured_values2[1]), 1, 1).strftime('%Y-%m-%d'),
-                    date(int(captured_values2[3]), 12, 31).strftime('%Y-%m-%d')]
+            return date(int(captured_values2[1]), 1, 1), date(int(captured_values2[3]), 12, 31)
         if m1:
-            return [date(int(captured_values1[1]), 1, 1).strftime('%Y-%m-%d'),
-                    date(int(captured_values1[1]), 12, 31).strftime('%Y-%m-%d')]
+            return date(int(captured_values1[1]), 1, 1), date(int(captured_values1[1]), 12, 31)
         else:
             return None
 
@@ -185,35 +1398,31 @@ class DateParsing:
         :param query:
         :return date / date range:
         """
+        return format_dates(self._before_dates(query.lower()), 'before')
+
+    def _before_dates(self, query):
         if "up to" in query:
             temp = query[query.index("up to") + 6:]
         elif "upto" in query:
             temp = query[query.index("upto") + 5:]
         else:
             temp = query[query.index("before") + 7:]
-        # dd[-/ .]mm[-/ .]yyyy
-        dateformat1_regex = re.compile('[0-3]?[0-9]{1}[-/ .]{1}[0-1]?[0-9]{1}((-|/| |.){1}\d{4})?(\s|$)')
-        # yyyy[-/ .]mm[-/ .]dd
-        dateformat2_regex = re.compile('[0-9]{4}[-/ .]{1}[0-1]?[0-9]{1}[-/ .]{1}[0-3]?[0-9]{1}')
-
-        if dateformat1_regex.search(temp):
-            dt_mth_yr = dateformat1_regex.search(temp).group().strip().split('/')
-            if len(dt_mth_yr) == 2:
-                return ['1970-1-1', date(date.today().year, int(dt_mth_yr[1]), int(dt_mth_yr[0])).strftime('%Y-%m-%d')]
-            else:
-                return ['1970-1-1', date(int(dt_mth_yr[2]), int(dt_mth_yr[1]), int(dt_mth_yr[0])).strftime('%Y-%m-%d')]
+        m1 = self.rules.numeric_regex.search(temp)
+        m2 = None if m1 else DATEFORMAT2_REGEX.search(temp)
 
-        elif dateformat2_regex.search(temp):
-            yr_mth_dt = dateformat2_regex.search(temp).group().strip().split('/')
+        if m1:
+            return EPOCH, self._numeric_date(m1.group().strip().split('/'))
+
+        elif m2:
+            yr_mth_dt = m2.group().strip().split('/')
             if len(yr_mth_dt) == 2:
-                return ['1970-1-1', date(int(yr_mth_dt[0]), int(yr_mth_dt[1]), 1).strftime('%Y-%m-%d')]
+                return EPOCH, date(int(yr_mth_dt[0]), int(yr_mth_dt[1]), 1)
             else:
-                return ['1970-1-1', date(int(yr_mth_dt[0]), int(yr_mth_dt[1]), int(yr_mth_dt[2])).strftime('%Y-%m-%d')]
+                return EPOCH, date(int(yr_mth_dt[0]), int(yr_mth_dt[1]), int(yr_mth_dt[2]))
         else:
-            dt = DateParser(temp).result()[0].strftime('%Y-%m-%d')
-            # print dt, date.today().strftime('%Y-%m-%d')
-            if dt is not None and dt != date.today().strftime('%Y-%m-%d'):
-                return ['1970-1-1', dt]
+            dt = self._first_fallback_date(temp)
+            if dt is not None and dt != self._engine_today():
+                return EPOCH, dt
             else:
                 return None
 
@@ -223,143 +1432,675 @@ class DateParsing:
         :param query:
         :return date / date range:
         """
+        return format_dates(self._after_dates(query.lower()), 'after')
+
+    def _after_dates(self, query):
         temp = query[query.index("after") + 6:]
-        # dd[-/ .]mm[-/ .]yyyy
-        dateformat1_regex = re.compile('[0-3]?[0-9]{1}[-/ .]{1}[0-1]?[0-9]{1}((-|/| |.){1}\d{4})?(\s|$)')
-        # yyyy[-/ .]mm[-/ .]dd
-        dateformat2_regex = re.compile('[0-9]{4}[-/ .]{1}[0-1]?[0-9]{1}[-/ .]{1}[0-3]?[0-9]{1}')
-
-        if dateformat1_regex.search(temp):
-            dt_mth_yr = dateformat1_regex.search(temp).group().strip().split('/')
-            if len(dt_mth_yr) == 2:
-                return [date(date.today().year, int(dt_mth_yr[1]), int(dt_mth_yr[0])).strftime('%Y-%m-%d'),
-                        date.today().strftime('%Y-%m-%d')]
-            else:
-                return [date(int(dt_mth_yr[2]), int(dt_mth_yr[1]), int(dt_mth_yr[0])).strftime('%Y-%m-%d'),
-                        date.today().strftime('%Y-%m-%d')]
+        m1 = self.rules.numeric_regex.search(temp)
+        m2 = None if m1 else DATEFORMAT2_REGEX.search(temp)
+
+        if m1:
+            return self._numeric_date(m1.group().strip().split('/')), self._today()
 
-        elif dateformat2_regex.search(temp):
-            yr_mth_dt = dateformat2_regex.search(temp).group().strip().split('/')
-            # print "after", dateformat2_regex.search(temp).group()
+        elif m2:
+            yr_mth_dt = m2.group().strip().split('/')
             if len(yr_mth_dt) == 2:
-                return [date(int(yr_mth_dt[0]), int(yr_mth_dt[1]), 1).strftime('%Y-%m-%d'), date.today().strftime('%Y-%m-%d')]
+                return date(int(yr_mth_dt[0]), int(yr_mth_dt[1]), 1), self._today()
             else:
-                return [date(int(yr_mth_dt[0]), int(yr_mth_dt[1]), int(yr_mth_dt[2])).strftime('%Y-%m-%d'),
-                        date.today().strftime('%Y-%m-%d')]
+                return date(int(yr_mth_dt[0]), int(yr_mth_dt[1]), int(yr_mth_dt[2])), self._today()
 
         else:
-            dt = DateParser(temp).result()[0].strftime('%Y-%m-%d')
-            # print dt, date.today().strftime('%Y-%m-%d')
-            if dt is not None and dt != date.today().strftime('%Y-%m-%d'):
-                return [dt, date.today().strftime('%Y-%m-%d')]
+            dt = self._first_fallback_date(temp)
+            if dt is not None and dt != self._engine_today():
+                return dt, self._today()
             else:
                 return None
 
+    def _numeric_date(self, parts):
+        """
+        :param parts: numbers of a nn/nn[/yyyy] date, day first or month first as per the rules
+        :return date, in the current year when the year is missing:
+        """
+        day, month = (parts[0], parts[1]) if self.rules.day_first else (parts[1], parts[0])
+        if len(parts) == 2:
+            return date(self._today().year, int(month), int(day))
+        return date(int(parts[2]), int(month), int(day))
+
     def only_month_capture(self, query):
         """
         Parse query for mentions of month after some pre-specified phrases
         :param query:
         :return:
         """
-        regex_month = re.compile(
-            r'(for|in|during|for the month of|for this|in the month of)'
-            r'{1}\s(January|February|March|April|May|June|July|August|September|October|November|December)(\s|$)', re.IGNORECASE)
-        regex_month_year = re.compile(r'(for|in|during|for the month of|for this)'
-                                      r'{1}\s(January|February|March|April|May|June|July|August|September|October|November|December)'
-                                      r'{1}\s([0-9]{4})', re.IGNORECASE)
+        return format_dates(self._month_dates(query.lower()), 'month')
+
+    def _month_dates(self, query):
         if "before" in query:
             temp = query[query.index("before") + 7:]
-            return ['1970-1-1', DateParser(temp).result()[0].strftime('%Y-%m-%d')]
+            dt = self._first_fallback_date(temp)
+            return _OpenRange((EPOCH, dt)) if dt is not None and dt != self._engine_today() else None
         elif "after" in query:
             temp = query[query.index("after") + 6:]
-            return [DateParser(temp).result()[0].strftime('%Y-%m-%d'), date.today().strftime('%Y-%m-%d')]
-        elif regex_month_year.search(query):
-            m = regex_month_year.search(query).groups()
-            start_date = date(int(m[2]), strptime(m[1][:3], '%b').tm_mon, 1)
-            end_date = date(int(m[2]), (strptime(m[1][:3], '%b').tm_mon) % 12 + 1, 1) - timedelta(days=1)
-            return [str(start_date), str(end_date)]
-        elif regex_month.search(query):
-            m = regex_month.search(query).groups()
-            start_date = date(date.today().year, strptime(m[1][:3], '%b').tm_mon, 1)
-            end_date = date(date.today().year, (strptime(m[1][:3], '%b').tm_mon)%12+1, 1) - timedelta(days=1)
-            return [str(start_date), str(end_date)]
+            dt = self._first_fallback_date(temp)
+            return (dt, self._today()) if dt is not None and dt != self._engine_today() else None
+        m_month_year = self.rules.month_year_regex.search(query)
+        m_month = None if m_month_year else self.rules.month_regex.search(query)
+        if m_month_year:
+            m = m_month_year.groups()
+            return self._month_span(int(m[2]), self.rules.months[m[1].lower()])
+        elif m_month:
+            m = m_month.groups()
+            return self._month_span(self._today().year, self.rules.months[m[1].lower()])
         else:
             return None
 
+    @staticmethod
+    def _month_span(year, month):
+        """
+        :param year:
+        :param month: month number
+        :return first and last day of the month:
+        """
+        return date(year, month, 1), date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+
+    def _quarter_dates(self, query):
+        """
+        Parse query for fiscal quarters / years, as defined by the rules
+        :param query:
+        :return date range(if any):
+        """
+        m = QUARTER_REGEX.search(query)
+        if m:
+            return self._fiscal_dates(m)
+        return None
+
+    def _fiscal_dates(self, m):
+        """
+        :param m: match object of QUARTER_PATTERN
+        :return date range of the fiscal quarter / year, the current one when no year is given:
+        """
+        if m.group('quarter_fy'):
+            return self.rules.fiscal_year(int(m.group('quarter_fy')))
+        year = m.group('quarter_y')
+        year = int(year) if year else self.rules.fiscal_year_of(self._today())
+        return self.rules.fiscal_quarter(year, int(m.group('quarter_q')))
+
     def n_month_capture(self, query):
         """
         Parse query for 'n month' type of phrases
         :return:
         """
-        word_to_num = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
-                       "nine": 9}
-        regex_n_month = re.compile(r'(last|past|previous)\s([0-9]|one|two|three|four|five|six|seven|eight|nine)'
-                                   r'\s(month|months)',
-                                   re.IGNORECASE)
-        if regex_n_month.search(query):
-            n_mth = list(regex_n_month.search(query).groups())
-            if n_mth[1] in word_to_num:
-                n_mth[1] = word_to_num[n_mth[1]]
-            start_date = (date.today() - timedelta(days=int(n_mth[1]) * 30)).replace(day=1)
-            end_date = date.today() - timedelta(days=date.today().day)
-            return [start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")]
-
-    def parse_date(self, query):
+        return format_dates(self._n_month_dates(query.lower()))
+
+    def _n_month_dates(self, query):
+        m = N_MONTH_REGEX.search(query)
+        if m:
+            n = PythonEngine._number_value(m.group(2))
+            # "last 0 months" has no range for the rule to give
+            return self._periods().last_months(n) if n else None
+
+    def _first_fallback_date(self, text):
+        """
+        :param text:
+        :return first date found by the fallback engine in text, or None:
+        """
+        date_list = self._fallback_result(text)
+        if not date_list:
+            return None
+        return as_date(date_list[0])
+
+    def parse_date(self, query, reference_date=None, as_range=False):
         """
         Main method that parses the date in a query using all the other methods
         :param query:
+        :param reference_date: date the relative phrases are resolved against, defaults to the clock's date
+        :param as_range: return a DateRange instead of a list of YYYY-MM-DD strings
         :return date range(if any):
         """
-        query = query.lower()
-        # check if the query contains only year reference eg. show sales for 2013
-        dates = self.only_year_parse(query)
-        if dates is not None:
-            return dates
+        if self.cache is not None:
+            return self.parse_dates([query], reference_date, as_range)[0]
+        with self._reference(reference_date):
+            return self._output(self._parse_lowered(query.lower()), as_range)
 
-        # check if query contains "before" or "after" references
-        if "before" in query or "upto" in query or "up to" in query:
-            dates = self.check_before(query)
-            if dates:
-                return dates
-        if "after" in query:
-            dates = self.check_after(query)
-            if dates:
-                return dates
-
-        # parse query for a list of time phrases specified by time_phrases_and_ops
-        for phrase, func in self.time_phrases_and_ops.items():
-            if phrase in query:
-                date_range = eval(func)
-                if len(date_range) == 2 and date_range[0] > date_range[1]:
-                    date_range[0], date_range[1] = date_range[1], date_range[0]
-                return date_range
-
-        # capture only months
-        dates = self.only_month_capture(query)
-        if dates:
-            return dates
+    def cache_info(self):
+        """
+        :return dict of the result cache counters, None when the cache is disabled:
+        """
+        if self.cache is None:
+            return None
+        return self.cache.info()
 
-        # capture n months
-        dates = self.n_month_capture(query)
-        if dates:
-            return dates
+    def parse_dates(self, queries, reference_date=None, as_range=False, errors='raise'):
+        """
+        Batch version of parse_date. The reference date is fixed once for the whole batch,
+        repeated queries are parsed once and the rule based methods resolve every query
+        before the remaining ones are sent to the fallback engine
+        :param queries: iterable of query strings
+        :param reference_date: date the relative phrases are resolved against, defaults to the clock's date
+        :param as_range: return DateRange objects (see pack_ranges) instead of lists of strings
+        :param errors: 'raise' lets the error of a failing query abort the batch, as parse_date
+                       does, 'return' puts the exception in the place of its result and goes on
+        :return list of date ranges in the order of queries:
+        """
+        if errors not in ('raise', 'return'):
+            raise ValueError("errors must be 'raise' or 'return', got %r" % (errors,))
+        lowered = [query.lower() for query in queries]
+        results = dict.fromkeys(lowered)
+        leftovers = []
+        fallback_texts = []
+        # holding the leftovers back only pays when their fallback texts can be sent together
+        prefetch = self.memo is not None or hasattr(self.engine, 'parse_many')
+        with self._reference(reference_date, rules_only=prefetch) as today:
+            pending = list(results)
+            if self.cache is not None:
+                cached = [self.cache.get(normalize_query(query), today, ResultCache._missing) for query in pending]
+                results.update((query, value) for query, value in zip(pending, cached)
+                               if value is not ResultCache._missing)
+                pending = [query for query, value in zip(pending, cached) if value is ResultCache._missing]
+            for query in pending:
+                try:
+                    results[query] = self._parse_lowered(query)
+                except _FallbackRequired as e:
+                    leftovers.append((query, e.resume))
+                    fallback_texts.append(e.args[0])
+                except Exception as e:
+                    if errors == 'raise':
+                        raise
+                    results[query] = e
+            self._local.rules_only = False
+            # send the first fallback text of every leftover query to the engine in one go
+            fallback_texts = list(dict.fromkeys(fallback_texts))
+            if fallback_texts:
+                self._local.prefetched = dict(zip(fallback_texts, self._engine_parse_many(fallback_texts, today)))
+            try:
+                for query, resume in leftovers:
+                    try:
+                        results[query] = self._parse_lowered(query, resume)
+                    except Exception as e:
+                        if errors == 'raise':
+                            raise
+                        results[query] = e
+            finally:
+                self._local.prefetched = None
+            if self.cache is not None:
+                for query in pending:
+                    if not isinstance(results[query], Exception):
+                        self.cache.put(normalize_query(query), today, results[query])
+        return [self._output(results[query], as_range) for query in lowered]
+
+    def parse_series(self, values, reference_date=None):
+        """
+        Column version of parse_dates for pandas / NumPy: every distinct value is parsed once,
+        through parse_dates, and the results are spread back over the rows as two
+        datetime64[D] arrays with NaT where nothing was found, the value isn't a string or its
+        parsing failed (eg. "upto 1998/5/18"), so one bad row doesn't lose the column.
+        Needs numpy; pandas, when installed, is used to find the distinct values
+        :param values: pandas Series, NumPy array or sequence of query strings
+        :param reference_date: date the relative phrases are resolved against, defaults to the clock's date
+        :return DataFrame of start and end columns sharing the index of a Series, (starts, ends) otherwise:
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("DateParsing.parse_series needs numpy, install it with pip install numpy")
+        try:
+            import pandas
+        except ImportError:
+            pandas = None
+        if pandas is not None:
+            if isinstance(values, (pandas.Series, pandas.Index, numpy.ndarray)):
+                codes, uniques = pandas.factorize(values)
+            else:
+                codes, uniques = pandas.factorize(numpy.asarray(values, dtype=object))
+        else:
+            index = {}
+            codes = numpy.array([index.setdefault(value, len(index)) if isinstance(value, str) else -1
+                                 for value in values], dtype='int64')
+            uniques = list(index)
+        queries = [value for value in uniques if isinstance(value, str)]
+        ranges = dict((query, None if isinstance(result, Exception) else result)
+                      for query, result in zip(queries, self.parse_dates(queries, reference_date, as_range=True,
+                                                                          errors='return')))
+        columns = []
+        for ordinals in pack_ranges(ranges.get(value) if isinstance(value, str) else None for value in uniques):
+            # the extra 0 at the end is the NaT picked by the -1 code of missing values
+            ordinals = numpy.append(numpy.array(ordinals, dtype='int64'), 0)
+            column = (ordinals - EPOCH.toordinal()).astype('datetime64[D]')
+            column[ordinals == 0] = numpy.datetime64('NaT')
+            columns.append(column[codes])
+        if pandas is not None and isinstance(values, pandas.Series):
+            return pandas.DataFrame({'start': columns[0], 'end': columns[1]}, index=values.index)
+        return columns[0], columns[1]
+
+    def extract_all(self, text, reference_date=None, as_range=False):
+        """
+        Find every date / date range mentioned in a text, e.g. a whole support ticket, in a
+        single scan. Unlike parse_date nothing is sent to the fallback engine: what the rules
+        don't resolve is read with the PythonEngine grammar. A date right after before / up to /
+        after gives an open range and two dates joined by to / till / and / - give a range
+        :param text:
+        :param reference_date: date the relative phrases are resolved against, defaults to the clock's date
+        :param as_range: give the dates as DateRange instead of a list of YYYY-MM-DD strings
+        :return list of DateMention in the order of the text:
+        """
+        found = []
+        keyword = None
+        with self._reference(reference_date) as today:
+            for m in self._matcher('extract').finditer(text):
+                if m.lastgroup == 'keyword':
+                    keyword = m
+                    continue
+                try:
+                    dates, rule = self._extract_dates(m, today)
+                except ValueError:
+                    # impossible dates, eg. 31/02
+                    keyword = None
+                    continue
+                start = m.start()
+                if m.lastgroup == 'point' and len(dates) == 1:
+                    previous = found[-1] if found else None
+                    if keyword is not None and keyword.end() == start:
+                        start = keyword.start()
+                        if keyword.group().strip().lower() == 'after':
+                            dates, rule = (dates[0], today), 'after'
+                        else:
+                            dates, rule = (EPOCH, dates[0]), 'before'
+                    elif previous is not None and previous[4] and \
+                            PythonEngine.RANGE_CONNECTOR_REGEX.fullmatch(text, previous[1], start):
+                        found.pop()
+                        start = previous[0]
+                        dates = tuple(sorted(previous[3] + dates))
+                keyword = None
+                # the last field tells whether the mention is a single date a range can start from
+                found.append((start, m.end(), rule, dates, m.lastgroup == 'point' and len(dates) == 1))
+        return [DateMention(start, end, text[start:end], rule,
+                            DateRange.from_dates(dates, rule) if as_range else format_dates(dates, rule))
+                for start, end, rule, dates, _ in found]
+
+    def _extract_dates(self, m, today):
+        """
+        Resolve a match of the extract_all scan
+        :param m: match object
+        :param today: reference date
+        :return (tuple of dates, rule name):
+        """
+        kind = m.lastgroup
+        g = m.group
+        if kind == 'point':
+            grammar = self._grammar
+            return tuple(grammar._resolve(grammar.POINT_REGEX.match(m.string, m.start(), m.end()), today)), 'fallback'
+        if kind in ('phrase', 'n_period'):
+            return self._phrase_match_dates(m), 'phrases'
+        if kind == 'year_span':
+            return (date(int(g('year_span_a')), 1, 1), date(int(g('year_span_b')), 12, 31)), 'year'
+        if kind == 'year':
+            year = int(g('year_y'))
+            if g('year_kw').lower() == 'before':
+                return (EPOCH, date(year, 1, 1)), 'year'
+            if g('year_kw').lower() == 'after':
+                return (date(year, 1, 1), today), 'year'
+            return (date(year, 1, 1), date(year, 12, 31)), 'year'
+        if kind == 'this_year':
+            return (date(today.year, 1, 1), today), 'year'
+        if kind == 'this_month':
+            # the range parse_date gives "this month", not the 1st of the month alone
+            return (date(today.year, today.month, 1), today), 'fallback'
+        if kind == 'slash_before':
+            # nn/nn[/yyyy] in the order of the rules or yyyy/mm[/dd], as the before / after rules read them
+            first, second, last = g('slash_a'), int(g('slash_b')), g('slash_c')
+            if len(first) == 4:
+                if last is not None and len(last) > 2:
+                    raise ValueError(m.group())
+                day = date(int(first), second, int(last or 1))
+            else:
+                if len(first) > 2 or last is not None and len(last) != 4:
+                    raise ValueError(m.group())
+                day_no, month = (int(first), second) if self.rules.day_first else (second, int(first))
+                day = date(int(last) if last else today.year, month, day_no)
+            if g('slash_kw').lower() == 'after':
+                return (day, today), 'after'
+            return (EPOCH, day), 'before'
+        if kind == 'month_year':
+            return self._month_span(int(g('month_year_y')), self.rules.months[g('month_year_m').lower()]), 'month'
+        if kind == 'month_name':
+            return self._month_span(today.year, self.rules.months[g('month_name_m').lower()]), 'month'
+        if kind == 'quarter':
+            return self._fiscal_dates(m), 'quarter'
+        n = PythonEngine._number_value(g('n_month_n'))
+        if not n:
+            raise ValueError(m.group())
+        return self._periods().last_months(n), 'n_month'
+
+    @staticmethod
+    def _output(result, as_range=False):
+        """
+        :param result: (dates, stage) pair returned by _parse_lowered, None or the exception of a failed query
+        :param as_range: build a DateRange instead of a list of strings
+        :return date range(if any), or the exception:
+        """
+        if result is None or isinstance(result, Exception):
+            return result
+        if as_range:
+            return DateRange.from_dates(*result)
+        return format_dates(*result)
+
+    def _parse_rules_only(self, query, reference_date):
+        """
+        Run the rule based methods only
+        :param query: lower cased query
+        :param reference_date:
+        :return (dates, stage) pair or None, raises _FallbackRequired if the fallback engine is needed:
+        """
+        with self._reference(reference_date, rules_only=True):
+            return self._parse_lowered(query)
 
-        # parse query using natty
-        dp = DateParser(query)
-        date_list = dp.result()
-        dates = []
+    def _parse_lowered(self, query, resume=None):
+        """
+        Run all the parsing methods on an already lower cased query, stage by stage
+        :param query:
+        :param resume: resume attribute of the _FallbackRequired the query raised in rules-only
+                       mode, to go on from the stage that needed the fallback engine
+        :return (tuple of dates, name of the stage that matched) or None:
+        """
+        # skip the rule families whose trigger words are missing from the query
+        families, first, spent = resume or (self.rules.classify(query), 0, 0.0)
+        profiler = self.profiler
+        i = first
+        start = default_timer() - spent
+        try:
+            if profiler is None:
+                for i in range(first, len(self._stages)):
+                    name, family, stage = self._stages[i]
+                    if family is None or family in families:
+                        dates = stage(query)
+                        if dates:
+                            return dates, name
+                return None
+
+            for i in range(first, len(self._stages)):
+                name, family, stage = self._stages[i]
+                if family is None or family in families:
+                    dates = profiler.run(name, stage, query)
+                    if dates:
+                        profiler.answered(query, name, default_timer() - start)
+                        return dates, name
+            profiler.answered(query, None, default_timer() - start)
+            return None
+        except _FallbackRequired as e:
+            # a stage is timed by the profiler once, when it is resumed
+            e.resume = families, i, default_timer() - start
+            raise
+
+    def _phrase_dates(self, query):
+        """
+        Parse query for a list of time phrases specified by time_phrases_and_ops
+        :param query:
+        :return date range(if any):
+        """
+        m = self._match_phrase(query)
+        if m:
+            return self._phrase_match_dates(m)
+        return None
+
+    def _phrase_match_dates(self, m):
+        """
+        :param m: match object of a pattern built by _phrase_pattern
+        :return date range of the matched phrase:
+        """
+        if m.lastgroup == 'n_period':
+            return self._periods().last(m.group('unit').lower(), PythonEngine._number_value(m.group('n')))
+        date_range = self._evaluate(self._phrase_operation(m.group('phrase').lower()))
+        if len(date_range) == 2 and date_range[0] > date_range[1]:
+            date_range = date_range[1], date_range[0]
+        return tuple(d if isinstance(d, date) else datetime.strptime(d, '%Y-%m-%d').date() for d in date_range)
+
+    def _fallback_dates(self, query):
+        """
+        Parse query using the fallback engine
+        :param query:
+        :return date range(if any):
+        """
+        date_list = self._fallback_result(query)
         if date_list is not None:
-            for d in date_list:
-                dates.append(d.strftime('%Y-%m-%d'))
-            if len(set(dates)) == 1 and dates[0] == date.today().strftime('%Y-%m-%d'):
+            dates = [as_date(d) for d in date_list]
+            # a bare "today" means the engine found no date
+            if len(set(dates)) == 1 and dates[0] == self._engine_today():
                 if "this month" in query or "current month" in query or "ongoing month" in query:
-                    return [date(date.today().year, date.today().month, 1).strftime('%Y-%m-%d'),
-                            date.today().strftime('%Y-%m-%d')]
+                    return date(self._today().year, self._today().month, 1), self._today()
                 else:
                     return None
             else:
                 if len(dates)==2 and dates[0] > dates[1]:
                     dates[0], dates[1] = dates[1], dates[0]
-                return dates
+                return tuple(dates)
         else:
-                return None
\ No newline at end of file
+            return None
+
+
+class AsyncDateParsing:
+    """
+    asyncio interface to DateParsing. Queries the rules resolve are answered inline, the ones
+    needing the fallback engine are parsed on a bounded thread pool and concurrent requests
+    for the same query share a single computation
+    """
+    def __init__(self, dt_parse=None, max_workers=4, max_pending=None, **kwargs):
+        """
+        :param dt_parse: DateParsing instance to wrap, built from kwargs when missing
+        :param max_workers: threads running fallback work
+        :param max_pending: fallback jobs allowed at once (running or queued), further
+                            callers wait for a slot. Defaults to 4 * max_workers
+        :param kwargs: DateParsing arguments
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        self.dt_parse = dt_parse if dt_parse is not None else DateParsing(**kwargs)
+        self.max_pending = max_pending or 4 * max_workers
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._semaphore = None
+        self._in_flight = {}
+
+    async def parse_date(self, query, reference_date=None):
+        """
+        :param query:
+        :param reference_date: defaults to the clock's date
+        :return date range(if any):
+        """
+        return (await self.parse_dates([query], reference_date))[0]
+
+    async def parse_dates(self, queries, reference_date=None):
+        """
+        :param queries: iterable of query strings
+        :param reference_date: defaults to the clock's date, read once for the batch
+        :return list of date ranges in the order of queries:
+        """
+        import asyncio
+        dt_parse = self.dt_parse
+        reference_date = as_date(reference_date or dt_parse.clock)
+        queries = [query.lower() for query in queries]
+        results = [None] * len(queries)
+        leftovers = {}
+        for i, query in enumerate(queries):
+            try:
+                results[i] = dt_parse._output(dt_parse._parse_rules_only(query, reference_date))
+            except _FallbackRequired:
+                leftovers.setdefault(query, []).append(i)
+        if leftovers:
+            new = [query for query in leftovers if (query, reference_date) not in self._in_flight]
+            if new:
+                batch = asyncio.ensure_future(self._fallback(new, reference_date))
+                for j, query in enumerate(new):
+                    self._coalesce((query, reference_date), self._pick(batch, j))
+            values = await asyncio.gather(*[asyncio.shield(self._in_flight[(query, reference_date)])
+                                            for query in leftovers])
+            for query, value in zip(leftovers, values):
+                for i in leftovers[query]:
+                    results[i] = value
+        return [list(result) if isinstance(result, list) else result for result in results]
+
+    def _coalesce(self, key, coroutine):
+        """
+        Register the computation of a query so concurrent requests for it can await it
+        """
+        import asyncio
+        future = asyncio.ensure_future(coroutine)
+        self._in_flight[key] = future
+        future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+    @staticmethod
+    async def _pick(batch, j):
+        return (await batch)[j]
+
+    async def _fallback(self, queries, reference_date):
+        """
+        Parse queries needing the fallback engine on the thread pool, waiting for a free slot
+        :return list of date ranges:
+        """
+        import asyncio
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+        async with self._semaphore:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self._executor, self.dt_parse.parse_dates, queries, reference_date)
+
+    def close(self):
+        """
+        Shut the thread pool down
+        """
+        self._executor.shutdown()
+
+
+_worker_parser = None
+
+
+def _init_worker(engine, memo=None, rules=None):
+    """
+    Process pool initializer giving every worker its own DateParsing and fallback engine
+    :param engine: engine name
+    :param memo: path of a FallbackMemo file
+    :param rules: rule pack names
+    """
+    global _worker_parser
+    _worker_parser = DateParsing(engine=engine, memo=memo, rules=rules)
+
+
+def _parse_chunk(queries, reference_date, errors='return'):
+    """
+    Parse a chunk of queries in a worker process
+    :param queries:
+    :param reference_date:
+    :param errors: see DateParsing.parse_dates
+    :return list of date ranges:
+    """
+    return _worker_parser.parse_dates(queries, reference_date, errors=errors)
+
+
+def parse_stream(queries, reference_date, workers=1, chunk_size=1000, engine='natty', memo=None, rules=None,
+                 errors='return'):
+    """
+    Function to parse an iterable of queries in chunks on a pool of worker processes. At most
+    two chunks per worker are in flight, so memory stays bounded whatever the input size.
+    A query that fails gets its exception as date range, the rest of its chunk is still parsed
+    :param queries: iterable of query strings
+    :param reference_date: date every query is resolved against
+    :param workers: number of worker processes, 1 parses in the calling process
+    :param chunk_size: number of queries sent to a worker at once
+    :param engine: fallback engine name
+    :param memo: path of a FallbackMemo file shared by the workers
+    :param rules: rule pack names, see DateParsing
+    :param errors: 'return' or 'raise' to stop on the first failing query, see DateParsing.parse_dates
+    :return generator of (query, date range or exception) pairs in input order:
+    """
+    queries = iter(queries)
+    chunks = iter(lambda: list(islice(queries, chunk_size)), [])
+    # forked workers inherit the shared matchers compiled here
+    dt_parse = DateParsing(engine=engine, memo=memo, rules=rules).prewarm()
+    if workers <= 1:
+        for chunk in chunks:
+            for pair in zip(chunk, dt_parse.parse_dates(chunk, reference_date, errors=errors)):
+                yield pair
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(engine, memo, rules)) as pool:
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append((chunk, pool.submit(_parse_chunk, chunk, reference_date, errors)))
+            if len(in_flight) >= 2 * workers:
+                chunk, future = in_flight.popleft()
+                for pair in zip(chunk, future.result()):
+                    yield pair
+        while in_flight:
+            chunk, future = in_flight.popleft()
+            for pair in zip(chunk, future.result()):
+                yield pair
+
+
+def _read_queries(lines, field=None):
+    """
+    Blank lines are skipped, and so are the records without a string query, which are
+    reported on stderr
+    :param lines: lines of plain text, or of JSON records when field is given
+    :param field: name of the query field of the JSON records
+    :return generator of queries:
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        if field is None:
+            yield line
+            continue
+        try:
+            query = json.loads(line)[field]
+        except ValueError as e:
+            sys.stderr.write('line %d skipped, invalid JSON: %s\n' % (number, e))
+            continue
+        except (KeyError, TypeError):
+            sys.stderr.write('line %d skipped, no %r field\n' % (number, field))
+            continue
+        if not isinstance(query, str):
+            sys.stderr.write('line %d skipped, %r is not a string\n' % (number, field))
+            continue
+        yield query
+
+
+def main(argv=None):
+    """
+    Command line entry point writing one JSON line {"query": ..., "dates": ...} per input query,
+    {"query": ..., "dates": null, "error": <exception name>} for the queries that fail
+    """
+    import argparse
+    arg_parser = argparse.ArgumentParser(description='Extract dates / date ranges from a log of queries')
+    arg_parser.add_argument('input', nargs='?', default='-', help='input file, - for stdin (default)')
+    arg_parser.add_argument('-o', '--output', default='-', help='output JSONL file, - for stdout (default)')
+    arg_parser.add_argument('--field', help='read JSONL input and take the query from this field')
+    arg_parser.add_argument('--workers', type=int, default=1, help='number of worker processes (default: 1)')
+    arg_parser.add_argument('--chunk-size', type=int, default=1000, help='queries per work unit (default: 1000)')
+    arg_parser.add_argument('--reference-date', type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                            default=date.today(), help='YYYY-MM-DD date relative phrases are resolved against '
+                                                       '(default: today)')
+    arg_parser.add_argument('--engine', choices=sorted(ENGINES), default='natty', help='fallback engine (default: natty)')
+    arg_parser.add_argument('--memo', help='SQLite file memoizing the fallback engine results, shared by the workers')
+    arg_parser.add_argument('--rules', type=lambda value: value.split(','),
+                            help='comma separated rule packs, eg. de,en (default: en)')
+    args = arg_parser.parse_args(argv)
+
+    source = sys.stdin if args.input == '-' else open(args.input)
+    sink = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        pairs = parse_stream(_read_queries(source, args.field), args.reference_date, args.workers,
+                             args.chunk_size, args.engine, args.memo, args.rules)
+        for query, dates in pairs:
+            if isinstance(dates, Exception):
+                record = {'query': query, 'dates': None, 'error': type(dates).__name__}
+            else:
+                record = {'query': query, 'dates': dates}
+            sink.write(json.dumps(record) + '\n')
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,25 @@
 #!/usr/bin/env python
-from unittest import TestCase
-from datetime import date, timedelta
-from date_parser import DateParsing
+from unittest import TestCase, skipIf
+from tempfile import TemporaryDirectory
+from contextlib import redirect_stderr
+from io import StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+import asyncio
+import json
+import os
+import pickle
+import sys
+import threading
+from datetime import date, datetime, timedelta
+from bench_dateParsing import GOLDEN_PATH, check_golden
+from date_parser import AsyncDateParsing, DateParsing, DateRange, FallbackMemo, PythonEngine, RULE_PACKS, StageProfiler, classify, pack_ranges, \
+    format_dates, main, parse_stream, period_table, TIME_PHRASES
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class TestDateParser(TestCase):
@@ -104,3 +122,429 @@ class TestDateParser(TestCase):
         self.assertEquals(dt_parse.parse_date("Sales in the month of February"),
                           ['2018-02-01', '2018-02-28'])
 
+    def test_parse_dates(self):
+
+        dt_parse = DateParsing()
+        queries = ["Sales in the past two days", "Show me sales in 2013", "sales after 12/12/2012",
+                   "what was the profit margin previous week", "sales for august", "Show me sales in 2013",
+                   "Sales for past three months", "Show me sales in postal code 2017"]
+
+        self.assertEquals(dt_parse.parse_dates(queries), [dt_parse.parse_date(query) for query in queries])
+
+        self.assertEquals(dt_parse.parse_dates(["show me last month sales"], reference_date=date(2018, 3, 14)),
+                          [['2018-02-01', '2018-02-28']])
+
+    def test_phrase_matcher(self):
+
+        dt_parse = DateParsing()
+
+        self.assertEquals(dt_parse.match_phrase("sales fortnightly"), "fortnightly")
+        self.assertEquals(dt_parse.match_phrase("sales last week vs previous year"), "last week")
+        self.assertEquals(dt_parse.match_phrase("sales in postal code 300"), None)
+
+        dt_parse.register_phrase("Last Decade", lambda: ['2008-01-01', '2017-12-31'])
+        self.assertEquals(dt_parse.parse_date("sales in the last decade"), ['2008-01-01', '2017-12-31'])
+
+    def test_classify(self):
+
+        self.assertEquals(classify("show me sales in 2013"), {'year'})
+        self.assertEquals(classify("sales upto december 8"), {'before', 'month'})
+        self.assertEquals(classify("sales after 4 july for the last two months"), {'after', 'month', 'n_month'})
+        self.assertEquals(classify("what was the profit margin previous week"), set())
+
+    def test_batched_fallback(self):
+
+        class RecordingEngine(PythonEngine):
+            calls = []
+
+            def parse(self, text, reference_date):
+                self.calls.append(text)
+                return PythonEngine.parse(self, text, reference_date)
+
+            def parse_many(self, texts, reference_date):
+                self.calls.append(list(texts))
+                return [PythonEngine.parse(self, text, reference_date) for text in texts]
+
+        dt_parse = DateParsing(engine=RecordingEngine())
+        queries = ["sales last friday", "Show me sales in 2013", "sales from 3 weeks ago", "sales last friday"]
+
+        self.assertEquals(dt_parse.parse_dates(queries, reference_date=date(2018, 3, 14)),
+                          [['2018-03-09'], ['2013-01-01', '2013-12-31'], ['2018-02-21'], ['2018-03-09']])
+        self.assertEquals(RecordingEngine.calls, [["sales last friday", "sales from 3 weeks ago"]])
+
+
+class TestPythonEngine(TestCase):
+
+    reference_date = date(2018, 3, 14)
+
+    def parse(self, query):
+        return DateParsing(engine='python').parse_dates([query], reference_date=self.reference_date)[0]
+
+    def test_parse_date(self):
+
+        self.assertEquals(self.parse("Sales in the past two days"), ['2018-03-12', '2018-03-14'])
+
+        self.assertEquals(self.parse("show me sales from 15th November to 6th December"), ['2018-11-15', '2018-12-06'])
+
+        self.assertEquals(self.parse("show me last two years data"), ['2016-03-14', '2018-03-14'])
+
+        self.assertEquals(self.parse("june 2017 sales information"), ['2017-06-01'])
+
+        self.assertEquals(self.parse("Show me sales in postal code 2017"), None)
+
+        self.assertEquals(self.parse("sales before january 3rd 2013"), ['1970-1-1', '2013-01-03'])
+
+        self.assertEquals(self.parse("sales after 4 july"), ['2018-07-04', '2018-03-14'])
+
+        self.assertEquals(self.parse("sales upto december 8"), ['1970-1-1', '2018-12-08'])
+
+        self.assertEquals(self.parse("sales for this month"), ['2018-03-01', '2018-03-14'])
+
+        self.assertEquals(self.parse("Sales on the 14th of January"), ['2018-01-14'])
+
+        self.assertEquals(self.parse("sales last friday"), ['2018-03-09'])
+
+        self.assertEquals(self.parse("orders from 3 weeks ago"), ['2018-02-21'])
+
+    def test_unknown_engine(self):
+
+        self.assertRaises(ValueError, DateParsing, engine='java')
+
+    def test_result_cache(self):
+
+        dt_parse = DateParsing(engine='python', cache_size=2)
+        queries = ["Sales last Friday", "sales last friday ", "show me sales in 2013", "sales from 3 weeks ago",
+                   "SALES LAST FRIDAY"]
+
+        self.assertEquals(dt_parse.parse_dates(queries, reference_date=self.reference_date),
+                          [['2018-03-09'], ['2018-03-09'], ['2013-01-01', '2013-12-31'], ['2018-02-21'],
+                           ['2018-03-09']])
+        self.assertEquals(dt_parse.parse_dates([" Sales from 3 weeks ago", "SHOW ME SALES IN 2013", "sales last friday"],
+                                               reference_date=self.reference_date),
+                          [['2018-02-21'], ['2013-01-01', '2013-12-31'], ['2018-03-09']])
+        self.assertEquals(dt_parse.cache_info(),
+                          {'hits': 2, 'misses': 5, 'evictions': 2, 'expirations': 0, 'size': 2, 'maxsize': 2})
+        self.assertEquals(DateParsing(engine='python').cache_info(), None)
+
+        # the cache never changes a result, punctuation included
+        queries = ["sales before 30/10, please", "orders after 1/2: region west", "sales before 30/10 please",
+                   "orders after 1/2 region west", "Sales last Friday?", "sales  last friday"]
+        uncached = DateParsing(engine='python')
+        cached = DateParsing(engine='python', cache_size=100)
+        for query in queries + queries:
+            self.assertEquals(cached.parse_date(query, self.reference_date),
+                              uncached.parse_date(query, self.reference_date))
+        self.assertEquals(cached.parse_dates(queries, self.reference_date),
+                          uncached.parse_dates(queries, self.reference_date))
+
+    def test_reference_clock(self):
+
+        dt_parse = DateParsing(engine='python', clock=self.reference_date)
+        self.assertEquals(dt_parse.parse_date("what was the profit margin previous week"), ['2018-02-26', '2018-03-05'])
+        self.assertEquals(dt_parse.last_month_evaluation(), ['2018-02-01', '2018-02-28'])
+        self.assertEquals(dt_parse.parse_date("Sales this year", reference_date=date(2017, 5, 2)),
+                          ['2017-01-01', '2017-05-02'])
+
+        ticks = []
+        dt_parse = DateParsing(engine='python', clock=lambda: ticks.append(1) or self.reference_date)
+        self.assertEquals(dt_parse.parse_date("Sales in the past two days"), ['2018-03-12', '2018-03-14'])
+        self.assertEquals(len(ticks), 1)
+
+    def test_parse_dates_errors(self):
+
+        dt_parse = DateParsing(engine='python')
+        queries = ["sales in 2013", "sales upto 1998/5/18", "sales last friday"]
+
+        with self.assertRaises(ValueError):
+            dt_parse.parse_dates(queries, self.reference_date)
+        results = dt_parse.parse_dates(queries, self.reference_date, errors='return')
+        self.assertEquals(results[0], ['2013-01-01', '2013-12-31'])
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEquals(results[2], ['2018-03-09'])
+        with self.assertRaises(ValueError):
+            dt_parse.parse_dates(queries, errors='ignore')
+
+    def test_natty_system_date(self):
+
+        # natty answers against the system date whatever the reference date
+        today = date.today()
+        answers = {"sales for this month": [today], "today": [today], "4 july": [date(today.year, 7, 4)]}
+
+        def groups(text):
+            if text not in answers:
+                return None
+            return [SimpleNamespace(dates=[SimpleNamespace(toString=d.isoformat) for d in answers[text]])]
+
+        natty = SimpleNamespace(jpype=SimpleNamespace(isThreadAttachedToJVM=lambda: True), lock=threading.Lock(),
+                                NattyParser=SimpleNamespace(parseDateIntoGroups=groups),
+                                parser=SimpleNamespace(parse=lambda value: datetime.strptime(value, '%Y-%m-%d')))
+        with patch.dict(sys.modules, {'natty': natty}):
+            dt_parse = DateParsing()
+            self.assertEquals(dt_parse.parse_date("sales for this month", self.reference_date),
+                              ['2018-03-01', '2018-03-14'])
+            self.assertEquals(dt_parse.parse_date("sales before today", self.reference_date), None)
+            self.assertEquals(dt_parse.parse_date("sales after today", self.reference_date), None)
+            self.assertEquals(dt_parse.parse_date("sales after 4 july", self.reference_date),
+                              ['%d-07-04' % today.year, '2018-03-14'])
+
+    def test_parse_stream(self):
+
+        queries = ["sales last friday", "Show me sales in 2013", "sales for this month", "sales after 4 july"] * 3
+        expected = list(zip(queries, DateParsing(engine='python').parse_dates(queries, self.reference_date)))
+
+        self.assertEquals(list(parse_stream(iter(queries), self.reference_date, chunk_size=5, engine='python')),
+                          expected)
+        self.assertEquals(list(parse_stream(iter(queries), self.reference_date, workers=2, chunk_size=2,
+                                            engine='python')), expected)
+
+    def test_parse_stream_errors(self):
+
+        queries = ["sales last friday", "sales upto 1998/5/18", "Show me sales in 2013"]
+        for workers in (1, 2):
+            pairs = list(parse_stream(queries, self.reference_date, workers=workers, chunk_size=3, engine='python'))
+            self.assertEquals([query for query, _ in pairs], queries)
+            self.assertEquals(pairs[0][1], ['2018-03-09'])
+            self.assertIsInstance(pairs[1][1], ValueError)
+            self.assertEquals(pairs[2][1], ['2013-01-01', '2013-12-31'])
+
+        with TemporaryDirectory() as directory:
+            source, output = os.path.join(directory, 'queries.jsonl'), os.path.join(directory, 'dates.jsonl')
+            with open(source, 'w') as f:
+                f.write('{"q": "sales last friday"}\n\n{"q": "sales upto 1998/5/18"}\n{"q": \n{"id": 4}\n'
+                        '{"q": "Show me sales in 2013"}\n')
+            stderr = StringIO()
+            with redirect_stderr(stderr):
+                main([source, '-o', output, '--field', 'q', '--engine', 'python', '--reference-date', '2018-03-14'])
+            with open(output) as f:
+                records = [json.loads(line) for line in f]
+        self.assertEquals(records, [{'query': 'sales last friday', 'dates': ['2018-03-09']},
+                                    {'query': 'sales upto 1998/5/18', 'dates': None, 'error': 'ValueError'},
+                                    {'query': 'Show me sales in 2013', 'dates': ['2013-01-01', '2013-12-31']}])
+        self.assertEquals([line.split(',')[0] for line in stderr.getvalue().splitlines()],
+                          ['line 4 skipped', 'line 5 skipped'])
+
+    def test_async_parse_date(self):
+
+        class CountingEngine(PythonEngine):
+            texts = []
+
+            def parse(self, text, reference_date):
+                self.texts.append(text)
+                return PythonEngine.parse(self, text, reference_date)
+
+        async_parse = AsyncDateParsing(engine=CountingEngine(), max_workers=2)
+
+        async def run():
+            return await asyncio.gather(async_parse.parse_date("sales last friday", self.reference_date),
+                                        async_parse.parse_date("Sales last Friday", self.reference_date),
+                                        async_parse.parse_date("show me sales in 2013", self.reference_date),
+                                        async_parse.parse_dates(["sales last friday", "orders from 3 weeks ago"],
+                                                                self.reference_date))
+
+        self.assertEquals(asyncio.run(run()),
+                          [['2018-03-09'], ['2018-03-09'], ['2013-01-01', '2013-12-31'],
+                           [['2018-03-09'], ['2018-02-21']]])
+        self.assertEquals(sorted(CountingEngine.texts), ["orders from 3 weeks ago", "sales last friday"])
+        async_parse.close()
+
+    def test_profiler(self):
+
+        events = []
+        dt_parse = DateParsing(engine='python', clock=self.reference_date, profiler=StageProfiler(events.append))
+        for query in ["Show me sales in 2013", "sales last friday", "previous week sales", "show me sales in postal code"]:
+            dt_parse.parse_date(query)
+
+        self.assertEquals([(event['query'], event['stage']) for event in events],
+                          [("show me sales in 2013", 'year'), ("sales last friday", 'fallback'),
+                           ("previous week sales", 'phrases'), ("show me sales in postal code", None)])
+        stats = dt_parse.profiler.stats()
+        self.assertEquals((stats['queries'], stats['unresolved']), (4, 1))
+        self.assertEquals(sorted(stats['stages']), ['fallback', 'phrases', 'year'])
+        self.assertEquals((stats['stages']['phrases']['calls'], stats['stages']['phrases']['hits']), (3, 1))
+        self.assertEquals(sum(stats['stages']['fallback']['histogram'].values()), 2)
+
+        # the rules-only pass of a batch doesn't count the stages a second time
+        dt_parse = DateParsing(engine='python', clock=self.reference_date, profiler=True)
+        self.assertEquals(dt_parse.parse_dates(["sales last friday", "Show me sales in 2013", "sales last friday"]),
+                          [['2018-03-09'], ['2013-01-01', '2013-12-31'], ['2018-03-09']])
+        stats = dt_parse.profiler.stats()
+        self.assertEquals((stats['queries'], stats['unresolved']), (2, 0))
+        self.assertEquals(dict((name, (counters['calls'], counters['hits']))
+                               for name, counters in stats['stages'].items()),
+                          {'year': (1, 1), 'phrases': (1, 0), 'fallback': (1, 1)})
+
+    def test_golden_corpus(self):
+
+        self.assertEquals(check_golden(GOLDEN_PATH), [])
+
+    def test_date_range_results(self):
+
+        dt_parse = DateParsing(engine='python', clock=self.reference_date)
+        ranges = dt_parse.parse_dates(["sales before 30/10", "june 2017 sales information", "sales in postal code"],
+                                      as_range=True)
+
+        self.assertEquals(ranges, [DateRange(date(1970, 1, 1).toordinal(), date(2018, 10, 30).toordinal(), 'before'),
+                                   DateRange(date(2017, 6, 1).toordinal(), None, 'fallback'), None])
+        self.assertEquals(ranges[0].isoformat(), ['1970-01-01', '2018-10-30'])
+        self.assertEquals((ranges[1].start_date, ranges[1].end_date), (date(2017, 6, 1), None))
+        self.assertRaises(AttributeError, setattr, ranges[0], 'rule', 'after')
+        self.assertEquals([list(column) for column in pack_ranges(ranges)],
+                          [[ranges[0].start, ranges[1].start, 0], [ranges[0].end, ranges[1].start, 0]])
+        self.assertEquals(dt_parse.parse_date("Show me sales in 2013", as_range=True).isoformat(),
+                          ['2013-01-01', '2013-12-31'])
+
+        # only the open starts are written 1970-1-1, not the ranges that begin on that day
+        self.assertEquals(dt_parse.parse_date("sales before 30/10"), ['1970-1-1', '2018-10-30'])
+        self.assertEquals(dt_parse.parse_date("sales during january 1970"), ['1970-01-01', '1970-01-31'])
+        self.assertEquals(format_dates(dt_parse._month_dates("sales before 4 july"), 'month'),
+                          ['1970-1-1', '2018-07-04'])
+
+    def test_period_table(self):
+        periods = period_table(self.reference_date)
+        self.assertIs(periods, period_table(self.reference_date))
+        self.assertEquals(periods.prior_quarter, (date(2017, 10, 1), date(2017, 12, 31)))
+        self.assertEquals(periods.last('quarter', 2), (date(2017, 7, 1), date(2017, 12, 31)))
+        self.assertEquals(periods.last('week', 3), (date(2018, 2, 12), date(2018, 3, 5)))
+        self.assertEquals(self.parse("revenue for the last 3 weeks"), ['2018-02-12', '2018-03-05'])
+        self.assertEquals(self.parse("orders past two quarters"), ['2017-07-01', '2017-12-31'])
+        self.assertEquals(periods.yesterday, (date(2018, 3, 13),))
+        self.assertEquals(self.parse("what was the profit margin yesterday"), ['2018-03-13'])
+        self.assertEquals([(m.text, m.dates) for m in DateParsing(engine='python').extract_all(
+            "refunds since the previous day", self.reference_date)], [("previous day", ['2018-03-13'])])
+        dt_parse = DateParsing(engine='python', clock=self.reference_date)
+        self.assertEquals(dt_parse.day_evaluation(), ['2018-03-13'])
+        self.assertEquals(period_table(date(2018, 3, 31)).last_months(1), (date(2018, 2, 1), date(2018, 2, 28)))
+        self.assertEquals(self.parse("sales for last 9 months"), ['2017-06-01', '2018-02-28'])
+        self.assertEquals(self.parse("sales for last 12 months"), ['2017-03-01', '2018-02-28'])
+        self.assertEquals(self.parse("sales for the last ten months"), ['2017-05-01', '2018-02-28'])
+        self.assertEquals(self.parse("sales for past 60 months"), ['2013-03-01', '2018-02-28'])
+        self.assertEquals([m.dates for m in dt_parse.extract_all("churn over the last 12 months")],
+                          [['2017-03-01', '2018-02-28']])
+
+    def test_extract_all(self):
+        dt_parse = DateParsing(engine='python')
+        text = "Sales after 4 july dropped. Compare last week with the past 3 weeks,\n" \
+               "orders before 12/02/2017, in march 2017 and from 15th November to 6th December."
+        mentions = dt_parse.extract_all(text, self.reference_date)
+        self.assertEquals([(m.text, m.rule, m.dates) for m in mentions], [
+            ('after 4 july', 'after', ['2018-07-04', '2018-03-14']),
+            ('last week', 'phrases', ['2018-02-26', '2018-03-05']),
+            ('past 3 weeks', 'phrases', ['2018-02-12', '2018-03-05']),
+            ('before 12/02/2017', 'before', ['1970-1-1', '2017-02-12']),
+            ('in march 2017', 'month', ['2017-03-01', '2017-03-31']),
+            ('15th November to 6th December', 'fallback', ['2018-11-15', '2018-12-06'])])
+        self.assertEquals([text[m.start:m.end] for m in mentions], [m.text for m in mentions])
+        self.assertEquals(dt_parse.extract_all("for december", self.reference_date, as_range=True)[0].dates,
+                          DateRange(date(2018, 12, 1).toordinal(), date(2018, 12, 31).toordinal(), 'month'))
+        self.assertEquals(dt_parse.extract_all("nothing to see, 31/02/2018", self.reference_date), [])
+        self.assertEquals(dt_parse.extract_all("sales for this month", self.reference_date)[0].dates,
+                          dt_parse.parse_date("sales for this month", self.reference_date))
+        self.assertEquals(dt_parse.parse_date("sales for this month", self.reference_date), ['2018-03-01', '2018-03-14'])
+
+    def test_shared_phrase_table(self):
+        first, second = DateParsing(engine='python'), DateParsing(engine='python').prewarm()
+        self.assertIs(first._matcher('phrase'), second._matcher('phrase'))
+        first.register_phrase("last sprint", lambda: (date(2018, 2, 26), date(2018, 3, 9)))
+        self.assertEquals(first.parse_date("bugs closed last sprint", self.reference_date), ['2018-02-26', '2018-03-09'])
+        self.assertEquals(second.match_phrase("bugs closed last sprint"), None)
+        self.assertNotIn("last sprint", TIME_PHRASES)
+        self.assertEquals(second.time_phrases_and_ops['last week'], second._week_dates)
+        self.assertIn("last sprint", first.time_phrases_and_ops)
+        with self.assertRaises(TypeError):
+            second.time_phrases_and_ops["last sprint"] = first.time_phrases_and_ops["last sprint"]
+
+    @skipIf(numpy is None, "numpy is not installed")
+    def test_parse_series(self):
+        dt_parse = DateParsing(engine='python')
+        starts, ends = dt_parse.parse_series(numpy.array(["Show me sales in 2013", None, "nothing here",
+                                                           "show me sales in 2013", "sales upto 1998/5/18"],
+                                                          dtype=object), self.reference_date)
+        self.assertEquals(starts.dtype, numpy.dtype('datetime64[D]'))
+        self.assertEquals([str(d) for d in starts], ['2013-01-01', 'NaT', 'NaT', '2013-01-01', 'NaT'])
+        self.assertEquals([str(d) for d in ends], ['2013-12-31', 'NaT', 'NaT', '2013-12-31', 'NaT'])
+
+    def test_fallback_memo(self):
+
+        class CountingEngine(PythonEngine):
+            texts = []
+
+            def parse_many(self, texts, reference_date):
+                self.texts.extend(texts)
+                return PythonEngine.parse_many(self, texts, reference_date)
+
+        queries = ["sales last friday", "Show me sales in 2013", "sales before 4 july", "nothing here"]
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'memo.sqlite')
+            expected = DateParsing(engine=CountingEngine(), memo=path).parse_dates(queries, self.reference_date)
+            self.assertEquals(CountingEngine.texts, ["sales last friday", "4 july", "nothing here"])
+            memo = FallbackMemo(path)
+            dt_parse = DateParsing(engine=CountingEngine(), memo=memo)
+            self.assertEquals(dt_parse.parse_dates(queries, self.reference_date), expected)
+            self.assertEquals(dt_parse.parse_date("sales before 4 july", self.reference_date), expected[2])
+            self.assertEquals(len(CountingEngine.texts), 3)
+            self.assertEquals(memo.info(), {'hits': 4, 'misses': 0, 'size': 3})
+            self.assertEquals(list(parse_stream(iter(queries), self.reference_date, workers=2, chunk_size=1,
+                                                engine='python', memo=path)), list(zip(queries, expected)))
+            self.assertEquals(memo.prune(self.reference_date), 0)
+            # 3 entries of CountingEngine, 3 of the python engine of parse_stream
+            self.assertEquals(memo.invalidate(self.reference_date), 6)
+            memo.close()
+
+            class SystemDateEngine(CountingEngine):
+                resolves_against_system_date = True
+
+            memo = DateParsing(engine=SystemDateEngine(), memo=Path(path)).memo
+            self.assertEquals(memo.path, Path(path))
+            dt_parse = DateParsing(engine=SystemDateEngine(), memo=memo)
+            dt_parse.parse_date("sales last friday", self.reference_date)
+            self.assertEquals(memo.get_many(["sales last friday"], self.reference_date, dt_parse._memo_namespace), {})
+            self.assertEquals(list(memo.get_many(["sales last friday"], date.today(), dt_parse._memo_namespace)),
+                              ["sales last friday"])
+
+            # engines and rules sharing the file don't read each other's results
+            for rules, expected in ((None, ['2018-04-03']), ('en_US', ['2018-03-04']), (None, ['2018-04-03'])):
+                dt_parse = DateParsing(engine='python', memo=memo, rules=rules)
+                self.assertEquals(dt_parse.parse_date("orders on 03/04/2018", self.reference_date), expected)
+            self.assertEquals(memo.get_many(["sales last friday"], date.today(),
+                                            DateParsing(engine='python', memo=memo)._memo_namespace), {})
+            memo.close()
+
+    def test_rule_packs(self):
+        us = DateParsing(engine='python', rules='en_US')
+        eu = DateParsing(engine='python', rules=['de', 'en'])
+        fiscal = DateParsing(engine='python', rules=RULE_PACKS['en_US'].replace(name='acme', fiscal_year_start=10))
+
+        self.assertEquals(us.parse_date("sales before 03/04/2018", self.reference_date), ['1970-1-1', '2018-03-04'])
+        self.assertEquals(self.parse("sales before 03/04/2018"), ['1970-1-1', '2018-04-03'])
+        self.assertEquals(eu.parse_date("orders on 03/04/2018", self.reference_date), ['2018-04-03'])
+        self.assertEquals(eu.parse_date("umsatz im märz 2017", self.reference_date), ['2017-03-01', '2017-03-31'])
+        self.assertEquals(eu.parse_date("sales in december", self.reference_date), ['2018-12-01', '2018-12-31'])
+        self.assertEquals(eu.parse_date("umsatz last freitag", self.reference_date), ['2018-03-09'])
+        self.assertIs(eu.rules, DateParsing(rules=('de', 'en')).rules)
+        self.assertEquals(self.parse("revenue for q3 2017"), ['2017-07-01', '2017-09-30'])
+        self.assertEquals(fiscal.parse_date("revenue for q1 2018", self.reference_date), ['2017-10-01', '2017-12-31'])
+        self.assertEquals(fiscal.parse_date("revenue in q2", self.reference_date), ['2018-01-01', '2018-03-31'])
+        self.assertEquals(fiscal.parse_date("revenue for fy2018", self.reference_date), ['2017-10-01', '2018-09-30'])
+        self.assertEquals([m.text for m in eu.extract_all("Umsatz im März 2017 und vor 3/4/2018", self.reference_date)],
+                          ['im März 2017', '3/4/2018'])
+        self.assertRaises(ValueError, DateParsing, rules='xx')
+
+        # equal packs are compiled once, whatever the instance they come from
+        acme = RULE_PACKS['en_US'].replace(name='acme', fiscal_year_start=10)
+        self.assertEquals(acme, RULE_PACKS['en_US'].replace(name='acme', fiscal_year_start=10))
+        self.assertIs(fiscal.rules, DateParsing(rules=acme.replace()).rules)
+        self.assertEquals(pickle.loads(pickle.dumps(acme)), acme)
+        self.assertNotEqual(acme, acme.replace(fiscal_year_start=7))
+        self.assertRaises(AttributeError, setattr, acme, 'day_first', True)
+        with self.assertRaises(TypeError):
+            acme.months['sept'] = 9
+
+        # the default rules are 'en', with one date order for the rules and the fallback engine
+        default, en = DateParsing(engine='python'), DateParsing(engine='python', rules='en')
+        for query in ["sales 25/12/2017", "sales 12/25/2017", "sales before 03/04/2018", "orders on 03/04/2018"]:
+            self.assertEquals(default.parse_date(query, self.reference_date), en.parse_date(query, self.reference_date))
+        self.assertEquals(default.parse_date("sales 25/12/2017", self.reference_date), ['2017-12-25'])
+        self.assertEquals(us.parse_date("sales 12/25/2017", self.reference_date), ['2017-12-25'])
+        self.assertEquals([m.dates for m in default.extract_all("before 03/04/2018, or on 03/04/2018",
+                                                                self.reference_date)],
+                          [['1970-1-1', '2018-04-03'], ['2018-04-03']])